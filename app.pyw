@@ -4,8 +4,10 @@ import threading
 import flet as ft
 from PIL import Image
 from functools import wraps
-from processor import ThermalImageProcessor
-from utils import generate_pdf_report, load_image_file, load_config_file, celsius_to_kelvin
+from cache import ResultCache
+from filters import DENOISE_FILTERS, DenoiseFilter
+from jobs import AnalysisQueue, JobCancelled
+from utils import load_config_file, celsius_to_kelvin
 
 ASSETS_PATH = './assets'
 
@@ -120,6 +122,11 @@ class App(ft.UserControl):
                               fit=ft.ImageFit.CONTAIN,
                               visible=False)
         self.image_name = ft.Text(value='Empty', visible=False)
+        self.image_paths = []
+
+        # Cola de análisis en segundo plano y su lista de progreso
+        self.analysis_queue = AnalysisQueue(cache=ResultCache())
+        self.jobs_view = ft.Column(spacing=5)
 
         self.temp_min = ft.TextField(label="Temperatura Mínima (ºC)")
         self.temp_max = ft.TextField(label="Temperatura Máxima (ºC)")
@@ -135,6 +142,12 @@ class App(ft.UserControl):
             read_only=True,
         )
         self.threshold = ft.TextField(label="Umbral de zona caliente", value="200")
+        self.denoise = ft.Dropdown(
+            label="Filtro de ruido",
+            value="bilateral",
+            options=[ft.dropdown.Option(name) for name in DENOISE_FILTERS],
+        )
+        self.denoise_params = {}  # filtro -> parámetros cargados del .ini
 
         self.config_file_picker = ft.FilePicker(on_result=self.load_config)
         self.image_file_picker = ft.FilePicker(on_result=self.load_image)
@@ -142,7 +155,7 @@ class App(ft.UserControl):
         self.load_image_button = ft.ElevatedButton(
             text="Cargar Imagen",
             icon="image",
-            on_click=lambda _: self.image_file_picker.pick_files(allow_multiple=False,
+            on_click=lambda _: self.image_file_picker.pick_files(allow_multiple=True,
                                                                  allowed_extensions=["jpg", "png"])
         )
         self.load_config_button = ft.ElevatedButton(
@@ -194,6 +207,9 @@ class App(ft.UserControl):
             self.fuel_flow.value = parameters.get('fuel_flow', 1)
             self.heat_transfer_coeff.value = parameters.get('heat_transfer_coeff', 1)
             self.ambient_temp.value = parameters.get('ambient_temp', 30)
+            if parameters.get('denoise'):
+                self.denoise.value = parameters['denoise']
+                self.denoise_params = {parameters['denoise']: parameters['denoise_params']}
             self.update()
             self.show_info('El archivo de configuración se ha cargado correctamente!')
 
@@ -201,14 +217,14 @@ class App(ft.UserControl):
     @exception_handler
     def load_image(self, e: ft.FilePickerResultEvent):
         if e.files:
+            self.image_paths = [f.path for f in e.files]
             self.image.src = e.files[0].path
             self.image.visible = True
-            self.image_name.value = e.files[0].name
+            self.image_name.value = e.files[0].name if len(e.files) == 1 else f'{len(e.files)} imágenes'
             self.image_name.visible = True
             self.update()
             self.show_info('La imagen se ha cargado correctamente!')
 
-    @loading_handler
     @exception_handler
     def generate_pdf_report(self, e):
         if not self.image.visible:
@@ -221,12 +237,7 @@ class App(ft.UserControl):
             self.temp_min.update()
             return
 
-        if not os.path.exists('./output'):
-            os.makedirs('./output')
-
-        thermal_processor = ThermalImageProcessor()
-        data, histogram = thermal_processor.process(
-            load_image_file(self.image.src),
+        parameters = (
             float(self.fuel_flow.value),
             float(self.heat_transfer_coeff.value),
             celsius_to_kelvin(float(self.ambient_temp.value)),
@@ -236,9 +247,52 @@ class App(ft.UserControl):
             celsius_to_kelvin(float(self.temp_min.value)),
             celsius_to_kelvin(float(self.temp_max.value)),
             int(self.threshold.value),
+            # Los parámetros del .ini solo se aplican si se mantiene el filtro que indica
+            DenoiseFilter(self.denoise.value, **self.denoise_params.get(self.denoise.value, {})),
         )
-        generate_pdf_report(data, histogram, './output/')
-        self.show_info("Operación completada!")
+
+        # Encolar cada imagen; el análisis corre en segundo plano sin bloquear la ventana
+        for image_path in self.image_paths:
+            name = os.path.splitext(os.path.basename(image_path))[0]
+            self.add_job(image_path, parameters, os.path.join('./output', name))
+
+    def add_job(self, image_path, parameters, output_folder):
+        progress_bar = ft.ProgressBar(width=200, value=0)
+        status = ft.Text('En cola', size=12)
+        cancel_button = ft.IconButton(icon="cancel", tooltip="Cancelar")
+        row = ft.Row([ft.Text(os.path.basename(image_path), width=150), progress_bar, status, cancel_button])
+
+        def on_progress(job, stage, fraction):
+            progress_bar.value = fraction
+            status.value = f'{stage} ({fraction:.0%})'
+            row.update()
+
+        def on_done(job, result):
+            cancel_button.visible = False
+            status.value = f'Completado: {len(result.zones)} zonas'
+            row.update()
+            self.show_info(f'Reporte generado en {job.output_folder}')
+
+        def on_error(job, ex):
+            cancel_button.visible = False
+            status.value = 'Cancelado' if isinstance(ex, JobCancelled) else f'Error: {ex}'
+            row.update()
+
+        # La fila debe estar en la página antes de que el hilo de análisis la actualice
+        self.jobs_view.controls.append(row)
+        self.update()
+
+        job = self.analysis_queue.submit(image_path, parameters, output_folder, on_progress, on_done, on_error)
+
+        def cancel(_):
+            if job.cancel():
+                on_error(job, JobCancelled())
+            else:
+                status.value = 'Cancelando...'
+                row.update()
+
+        cancel_button.on_click = cancel
+        cancel_button.update()
 
     def build(self):
         self.page.vertical_alignment = 'start'
@@ -272,8 +326,10 @@ class App(ft.UserControl):
                 ]),
                 ft.Row([
                     self.threshold,
+                    self.denoise,
                     self.generate_report_button,
-                ])
+                ]),
+                self.jobs_view,
                 # self.load_image_button,
                 # self.load_config_button,
                 # self.temp_min,
@@ -344,7 +400,25 @@ def main(page: ft.Page):
         # ),
     )
 
-    page.add(App())
+    app = App()
+
+    def close_window(e):
+        """
+        Detiene la cola de análisis antes de cerrar la ventana, para no dejar reportes a medias.
+
+        :param e: The event that triggered the function
+        :type e: WindowEvent
+        """
+
+        if e.data == 'close':
+            app.analysis_queue.shutdown()
+            page.window_destroy()
+
+    page.window_prevent_close = True
+    page.on_window_event = close_window
+    page.on_disconnect = lambda e: app.analysis_queue.shutdown()
+
+    page.add(app)
 
 
 ft.app(target=main, assets_dir=ASSETS_PATH)
@@ -0,0 +1,315 @@
+import io
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from export import zone_records, zone_geometry
+from filters import DENOISE_FILTERS
+from processor import ThermalImageProcessor, ZONE_ENGINES
+from settings import B, AC, TAF, CO, DIAMETER
+from utils import generate_pdf_report, load_config_file, celsius_to_kelvin
+
+SYNTHETIC_SIZES = ['640x480', '1920x1080', '3840x2160']
+STARTUP_MODULES = ['processor', 'main']
+# Dependencias que el núcleo de análisis no debería cargar al arrancar
+HEAVY_MODULES = ['fpdf', 'matplotlib', 'PIL', 'flet']
+STAGES = [
+    'apply_denoise_filter',
+    'calculate_grayscale_map',
+    'find_hot_zones',
+    'calculate_temperature_map',
+    'calculate_histogram',
+    'calculate_heat_loss',
+    'generate_pdf_report',
+    'export_zones',
+]
+
+
+def synthetic_frame(processor, width, height, zones, seed=0):
+    """
+    Genera una imagen térmica sintética con `zones` zonas calientes elípticas sobre un fondo templado,
+    coloreada con la paleta del procesador y con algo de ruido para que no todos los colores sean exactos.
+    """
+
+    rng = np.random.default_rng(seed)
+    grey = cv2.GaussianBlur(rng.integers(40, 140, (height, width), dtype=np.uint8), (0, 0), 15)
+
+    scale = min(width, height) / 480
+    for _ in range(zones):
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = (int(rng.integers(5, 40) * scale), int(rng.integers(5, 40) * scale))
+        cv2.ellipse(grey, center, axes, float(rng.uniform(0, 180)), 0, 360, int(rng.integers(215, 256)), -1)
+
+    grey = cv2.GaussianBlur(grey, (5, 5), 0)
+    colors = processor.palette_colors[np.argsort(processor.palette_values, kind='stable')].astype(np.uint8)
+    frame = colors[grey]
+    noise = rng.integers(-3, 4, frame.shape)
+    return np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def default_parameters(width):
+    """Parámetros físicos para las imágenes sintéticas a partir de las constantes de `settings`."""
+
+    return {
+        'b': B, 'ac': AC, 'taf': TAF, 'co': CO, 'd': DIAMETER, 'bw': width,
+        'min_temp': celsius_to_kelvin(34.6), 'max_temp': celsius_to_kelvin(257.5),
+    }
+
+
+def config_parameters(config_file):
+    """Parámetros físicos de un archivo .ini, convertidos igual que en `main.analyze_image`."""
+
+    config = load_config_file(config_file)
+    return {
+        'b': config['fuel_flow'], 'ac': config['heat_transfer_coeff'],
+        'taf': celsius_to_kelvin(config['ambient_temp']), 'co': CO,
+        'd': config['boiler_width_m'], 'bw': config['boiler_width_px'],
+        'min_temp': celsius_to_kelvin(config['min_temp']), 'max_temp': celsius_to_kelvin(config['max_temp']),
+    }
+
+
+def stage_functions(processor, image, params, threshold_hot):
+    """
+    Prepara una función sin argumentos por etapa. Las entradas de cada etapa se calculan una vez con las
+    etapas anteriores para poder medir cada una por separado.
+    """
+
+    p = params
+    filtered = processor.apply_denoise_filter(image)
+    grayscale = processor.calculate_grayscale_map(filtered)
+    histogram = processor.calculate_histogram(grayscale, p['min_temp'], p['max_temp'])
+
+    if processor.zone_engine == 'components':
+        def find_zones():
+            return processor.calculate_hot_mask(grayscale, threshold_hot)
+
+        def heat_loss():
+            return processor.calculate_heat_loss_components(image, grayscale, mask, p['b'], p['ac'], p['taf'],
+                                                            p['co'], p['d'], p['bw'], p['min_temp'],
+                                                            p['max_temp'])
+
+        mask = find_zones()
+    else:
+        def find_zones():
+            return processor.find_hot_zones(grayscale, threshold_hot)
+
+        def heat_loss():
+            return processor.calculate_heat_loss(image, grayscale, contours, hierarchy, p['b'], p['ac'], p['taf'],
+                                                 p['co'], p['d'], p['bw'], p['min_temp'], p['max_temp'])
+
+        contours, hierarchy = find_zones()
+
+    zones = heat_loss()
+
+    return {
+        'apply_denoise_filter': lambda: processor.apply_denoise_filter(image),
+        'calculate_grayscale_map': lambda: processor.calculate_grayscale_map(filtered),
+        'find_hot_zones': find_zones,
+        'calculate_temperature_map': lambda: processor.calculate_temperature_map(grayscale, p['max_temp'],
+                                                                                 p['min_temp']),
+        'calculate_histogram': lambda: processor.calculate_histogram(grayscale, p['min_temp'], p['max_temp']),
+        'calculate_heat_loss': heat_loss,
+        'generate_pdf_report': lambda: generate_pdf_report(zones, histogram, stream=io.BytesIO(),
+                                                           workers=processor.zone_workers),
+        'export_zones': lambda: (zone_records(zones), np.savez_compressed(io.BytesIO(), **zone_geometry(zones))),
+    }, zones
+
+
+def measure(func, repeat):
+    """
+    Ejecuta `func` `repeat` veces midiendo el tiempo y una vez más con tracemalloc para el pico de memoria
+    (las asignaciones de NumPy quedan registradas; las internas de OpenCV no).
+    """
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = np.array(timings)
+    return {
+        'runs': repeat,
+        'mean': float(timings.mean()),
+        'min': float(timings.min()),
+        'max': float(timings.max()),
+        'p50': float(np.percentile(timings, 50)),
+        'p90': float(np.percentile(timings, 90)),
+        'p99': float(np.percentile(timings, 99)),
+        'peak_memory_bytes': int(peak),
+    }
+
+
+def benchmark_image(processor, name, image, params, threshold_hot, repeat):
+    """Mide todas las etapas sobre una imagen y devuelve su registro de resultados."""
+
+    stages, zones = stage_functions(processor, image, params, threshold_hot)
+    results = {stage: measure(stages[stage], repeat) for stage in STAGES}
+
+    return {
+        'image': name,
+        'shape': list(image.shape[:2]),
+        'engine': processor.zone_engine,
+        'denoise': processor.denoise.name,
+        'lut_bits': processor.lut_bits,
+        'lut_error': processor.lut_error,
+        'zone_workers': processor.zone_workers,
+        'zones': len(zones),
+        'total_area': sum(zone.area for zone in zones),
+        'total_heat_loss': sum(zone.heat_loss for zone in zones),
+        'stages': results,
+        'total_p50': sum(result['p50'] for result in results.values()),
+    }
+
+
+def compare_quality(record, reference):
+    """
+    Agrega a `record` la diferencia de sus resultados respecto a `reference` (la misma imagen y motor con el
+    filtro bilateral original): zonas de más o de menos y error relativo del área y la pérdida de calor.
+    """
+
+    def relative(key):
+        return (record[key] - reference[key]) / reference[key] if reference[key] else 0.0
+
+    record['quality'] = {
+        'reference': reference['denoise'],
+        'zones_diff': record['zones'] - reference['zones'],
+        'area_error': relative('total_area'),
+        'heat_loss_error': relative('total_heat_loss'),
+        'filter_speedup': (reference['stages']['apply_denoise_filter']['p50']
+                           / max(record['stages']['apply_denoise_filter']['p50'], 1e-9)),
+    }
+
+
+def import_time(module, repeat=5):
+    """
+    Mide con `python -X importtime` el tiempo de importar `module` en un intérprete nuevo, como el arranque
+    de una invocación de la línea de comandos o de un proceso trabajador del modo batch.
+
+    :return: dict con el tiempo acumulado de la importación (segundos) y las dependencias pesadas cargadas
+    """
+
+    folder = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    loaded = set()
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=folder,
+                                capture_output=True, text=True, check=True)
+        for line in result.stderr.splitlines():
+            parts = line.split('|')
+            if not line.startswith('import time:') or len(parts) != 3 or not parts[1].strip().isdigit():
+                continue
+            name = parts[2].strip()
+            loaded.add(name.split('.')[0])
+            if name == module:
+                timings.append(int(parts[1]) / 1e6)
+
+    timings = np.array(timings)
+    return {
+        'module': module,
+        'runs': repeat,
+        'mean': float(timings.mean()),
+        'min': float(timings.min()),
+        'heavy_imports': [name for name in HEAVY_MODULES if name in loaded],
+    }
+
+
+def run(input_folder, sizes, zones, engines, lut_bits, threshold_hot, repeat, filters=('bilateral',), zone_workers=1):
+    """
+    Ejecuta el benchmark sobre las imágenes de ejemplo y las sintéticas con cada motor de zonas y cada filtro
+    de ruido. Los filtros distintos del bilateral se comparan en calidad con el bilateral (ver
+    `compare_quality`). `zone_workers` son los hilos de cada imagen (ver `ThermalImageProcessor`).
+    """
+
+    samples = []
+    for image_path in sorted(glob.glob(os.path.join(input_folder, '*.jpg'))):
+        config_path = os.path.splitext(image_path)[0] + '.ini'
+        if os.path.exists(config_path):
+            samples.append((image_path, cv2.imread(image_path), config_parameters(config_path)))
+
+    filters = ['bilateral'] + [name for name in filters if name != 'bilateral']
+    records = []
+    for engine in engines:
+        processor = ThermalImageProcessor(lut_bits, engine, zone_workers=zone_workers)
+
+        frames = list(samples)
+        for size in sizes:
+            width, height = (int(v) for v in size.split('x'))
+            frames.append((f'synthetic_{size}_{zones}z', synthetic_frame(processor, width, height, zones),
+                           default_parameters(width)))
+
+        for name, image, params in frames:
+            reference = None
+            for denoise in filters:
+                processor.denoise = processor.denoise_filter(denoise)
+                record = benchmark_image(processor, name, image, params, threshold_hot, repeat)
+                if reference is None:
+                    reference = record
+                else:
+                    compare_quality(record, reference)
+                print(f"{engine:>10} {denoise:>14} {name:>28} {record['zones']:>5} zonas "
+                      f"{record['total_p50']:.4f} s", file=sys.stderr)
+                records.append(record)
+
+        processor.close()
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'threshold_hot': threshold_hot,
+            'zone_workers': zone_workers,
+        },
+        'results': records,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark de las etapas de ThermalImageProcessor.process')
+    parser.add_argument('-d', '--input-folder', help='Carpeta con parejas imagen/.ini', default='caldera')
+    parser.add_argument('-s', '--sizes', nargs='*', default=SYNTHETIC_SIZES,
+                        help='Tamaños de las imágenes sintéticas (ANCHOxALTO)')
+    parser.add_argument('-z', '--zones', type=int, default=20, help='Zonas calientes por imagen sintética')
+    parser.add_argument('-e', '--engines', nargs='+', choices=ZONE_ENGINES, default=['contours'],
+                        help='Motores de zonas a comparar')
+    parser.add_argument('-f', '--filters', nargs='+', choices=DENOISE_FILTERS, default=['bilateral'],
+                        help='Filtros de ruido a comparar con el bilateral')
+    parser.add_argument('--lut-bits', type=int, default=None, help='Bits por canal de la tabla de búsqueda')
+    parser.add_argument('-th', '--threshold-hot', type=int, default=200, help='Threshold utilizado')
+    parser.add_argument('--zone-workers', type=int, default=1,
+                        help='Hilos para medir las zonas y codificar las miniaturas de cada imagen')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Repeticiones por etapa')
+    parser.add_argument('-o', '--output', help='Archivo JSON de resultados (por defecto stdout)')
+    parser.add_argument('--startup', action='store_true',
+                        help='Medir solo el tiempo de importación de los módulos (python -X importtime)')
+    args = parser.parse_args()
+
+    if args.startup:
+        report = {'meta': {'python': platform.python_version(), 'repeat': args.repeat},
+                  'startup': [import_time(module, args.repeat) for module in STARTUP_MODULES]}
+    else:
+        report = run(args.input_folder, args.sizes, args.zones, args.engines, args.lut_bits, args.threshold_hot,
+                     args.repeat, args.filters, args.zone_workers)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
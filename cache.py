@@ -0,0 +1,99 @@
+import os
+import threading
+import zipfile
+import hashlib
+
+import numpy as np
+
+from settings import RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES
+
+
+class ResultCache:
+    """
+    Caché en disco de resultados intermedios, direccionada por contenido: cada entrada es un archivo .npz
+    cuyo nombre es la huella de la imagen y de los parámetros que la producen. Al superar `max_bytes` se
+    eliminan las entradas usadas hace más tiempo (la fecha de modificación se actualiza en cada lectura).
+    """
+
+    def __init__(self, cache_dir=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Calcula la clave de una entrada. Los arrays se identifican por su contenido, forma y tipo; el resto
+        de las partes por su representación como texto.
+
+        :return: str
+        """
+
+        digest = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                digest.update(f'{part.shape}{part.dtype}'.encode())
+                digest.update(np.ascontiguousarray(part).data)
+            else:
+                digest.update(repr(part).encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npz')
+
+    def load(self, key):
+        """
+        :return: dict con los arrays de la entrada, o None si no existe o está dañada
+        """
+
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(path)
+        except (OSError, ValueError, zipfile.BadZipFile):
+            return None
+
+        return arrays
+
+    def store(self, key, **arrays):
+        """Guarda los arrays de una entrada y aplica el límite de tamaño de la caché."""
+
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+        self.evict()
+
+    def evict(self):
+        """Elimina las entradas menos usadas recientemente hasta que la caché no supere `max_bytes`."""
+
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Elimina todas las entradas."""
+
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.npz'):
+                os.remove(os.path.join(self.cache_dir, name))
@@ -0,0 +1,146 @@
+import os
+import csv
+import json
+
+import numpy as np
+
+from zones import pack_zone_geometry
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'npz')
+ZONE_FIELDS = ['image', 'zone', 'x', 'y', 'width', 'height', 'area', 'mean_temp', 'heat_loss']
+
+# Columnas de la geometría con una fila por zona y columnas de puntos con sus offsets
+GEOMETRY_ZONE_COLUMNS = ('area', 'mean_temp', 'heat_loss', 'bbox')
+GEOMETRY_POINT_COLUMNS = (('contour_points', 'contour_offsets'), ('hole_points', 'hole_offsets'))
+
+
+def export_path(output_folder, export_format):
+    """Ruta del archivo de zonas de un formato dentro de la carpeta de salida."""
+
+    return os.path.join(output_folder, f'zonas.{export_format}')
+
+
+def zone_records(zones, image=None):
+    """
+    Convierte las zonas de una imagen en filas planas (una por zona) con sus medidas.
+
+    :param zones: iterable de `HeatZone`
+    :param image: identificador de la imagen (por ejemplo su ruta) que se agrega a cada fila
+    :return: lista de dict con las claves de `ZONE_FIELDS`
+    """
+
+    records = []
+    for index, zone in enumerate(zones):
+        x, y, w, h = zone.bbox
+        records.append({'image': image, 'zone': index, 'x': x, 'y': y, 'width': w, 'height': h,
+                        'area': zone.area, 'mean_temp': zone.mean_temp, 'heat_loss': zone.heat_loss})
+
+    return records
+
+
+def zone_geometry(zones, image=None):
+    """
+    Convierte las zonas de una imagen en arrays por columnas: medidas y bbox por zona, y los puntos de
+    contornos y huecos concatenados con sus offsets (ver `zones.pack_zone_geometry`). Las zonas sin contorno
+    (modo por mosaicos) guardan un contorno vacío.
+
+    :return: dict de np.ndarray que se puede unir a otros con `concatenate_geometry`
+    """
+
+    arrays = pack_zone_geometry(zones)
+    # Con escala 1 'area_px' conserva el área en m² de cada zona
+    arrays['area'] = arrays.pop('area_px')
+    arrays['heat_loss'] = np.array([zone.heat_loss for zone in zones], dtype=np.float64)
+    arrays['image'] = np.array([image or ''])
+    arrays['image_offsets'] = np.array([0, len(arrays['area'])])
+    return arrays
+
+
+def concatenate_geometry(geometries):
+    """
+    Une la geometría de varias imágenes (de `zone_geometry` o de un archivo ya unido) en un solo conjunto de
+    arrays. `image_offsets` indica el rango de zonas de cada imagen y `hole_zone` se renumera para apuntar a
+    la zona dentro del conjunto completo.
+    """
+
+    arrays = {name: np.concatenate([g[name] for g in geometries])
+              for name in ('image', 'hole_zone') + GEOMETRY_ZONE_COLUMNS +
+              tuple(points for points, _ in GEOMETRY_POINT_COLUMNS)}
+
+    zone_starts = np.cumsum([0] + [len(g['area']) for g in geometries])[:-1]
+    arrays['hole_zone'] += np.repeat(zone_starts, [len(g['hole_zone']) for g in geometries])
+    arrays['image_offsets'] = _concatenate_offsets([g['image_offsets'] for g in geometries])
+    for _, offsets in GEOMETRY_POINT_COLUMNS:
+        arrays[offsets] = _concatenate_offsets([g[offsets] for g in geometries])
+
+    return arrays
+
+
+def _concatenate_offsets(offsets):
+    """Une arrays de offsets acumulados (que empiezan en 0) desplazando cada uno al final del anterior."""
+
+    starts = np.cumsum([0] + [o[-1] for o in offsets])
+    return np.concatenate([[0]] + [o[1:] + start for o, start in zip(offsets, starts)]).astype(np.int64)
+
+
+def write_zone_records(records, output_file):
+    """
+    Agrega filas de `zone_records` a un archivo CSV (con encabezado si es nuevo) o JSON lines (`.jsonl`), de
+    modo que varias imágenes o ejecuciones se acumulan en el mismo archivo.
+
+    :return: número de filas escritas
+    """
+
+    if os.path.splitext(output_file)[1].lower() == '.jsonl':
+        with open(output_file, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+    else:
+        new_file = not os.path.exists(output_file) or os.path.getsize(output_file) == 0
+        with open(output_file, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=ZONE_FIELDS)
+            if new_file:
+                writer.writeheader()
+            writer.writerows(records)
+
+    return len(records)
+
+
+def write_zone_geometry(geometries, output_file):
+    """
+    Agrega la geometría de una o varias imágenes a un archivo `.npz` comprimido. Si el archivo existe se une
+    su contenido con el nuevo; el archivo se reemplaza completo al final para no dejarlo a medias.
+
+    :param geometries: lista de dict de `zone_geometry`
+    """
+
+    if os.path.exists(output_file):
+        with np.load(output_file) as data:
+            geometries = [{name: data[name] for name in data.files}] + list(geometries)
+
+    tmp_path = f'{output_file}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **concatenate_geometry(geometries))
+    os.replace(tmp_path, output_file)
+
+
+def export_zones(entries, output_folder, formats):
+    """
+    Escribe las zonas de una o varias imágenes en los formatos pedidos dentro de `output_folder`
+    (`zonas.csv`, `zonas.jsonl`, `zonas.npz`), agregándolas a los archivos existentes.
+
+    :param entries: lista de tuple (filas de `zone_records`, geometría de `zone_geometry`)
+    :param formats: iterable de `EXPORT_FORMATS`
+    :return: lista de rutas escritas
+    """
+
+    paths = []
+    for export_format in formats:
+        path = export_path(output_folder, export_format)
+        if export_format == 'npz':
+            write_zone_geometry([geometry for _, geometry in entries], path)
+        else:
+            write_zone_records([record for records, _ in entries for record in records], path)
+        paths.append(path)
+
+    return paths
@@ -0,0 +1,160 @@
+import math
+
+import cv2
+import numpy as np
+
+DENOISE_FILTERS = ('bilateral', 'fast_bilateral', 'gaussian', 'median', 'mean', 'none')
+
+# Parámetros por defecto de cada filtro; los de 'bilateral' son los del procesamiento original
+DEFAULT_PARAMS = {
+    'bilateral': {'diameter': 9, 'sigma_color': 75, 'sigma_space': 75},
+    'fast_bilateral': {'diameter': 9, 'sigma_color': 75, 'sigma_space': 75, 'scale': 0.5},
+    'gaussian': {'ksize': 5},
+    'median': {'ksize': 5},
+    'mean': {'ksize': 5},
+    'none': {},
+}
+
+# Parámetros que OpenCV espera como enteros
+INTEGER_PARAMS = ('diameter', 'ksize')
+
+
+def fast_bilateral_filter(image, diameter=9, sigma_color=75, sigma_space=75, scale=0.5):
+    """
+    Aproximación rápida del filtro bilateral: filtra la imagen reducida por `scale` y la devuelve a la
+    resolución original guiándose por la imagen sin reducir. Al ampliar se suma de nuevo el detalle que
+    perdió la reducción (imagen original menos imagen reducida y ampliada), ponderado por su magnitud con
+    el mismo `sigma_color` del filtro: el ruido (diferencias pequeñas) se descarta y los bordes
+    (diferencias grandes) se conservan nítidos. Todas las operaciones son de OpenCV sobre enteros.
+
+    :param scale: factor de reducción entre 0 y 1; el diámetro y `sigma_space` se reducen en proporción
+    :return: np.ndarray uint8 con la forma de `image`
+    """
+
+    height, width = image.shape[:2]
+    size = (max(round(width * scale), 1), max(round(height * scale), 1))
+    small = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    small_filtered = cv2.bilateralFilter(small, max(round(diameter * scale), 1), sigma_color, sigma_space * scale)
+
+    base = cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+    filtered = cv2.resize(small_filtered, (width, height), interpolation=cv2.INTER_LINEAR)
+
+    # Peso del detalle (0-255) según la mayor diferencia entre canales
+    difference = cv2.absdiff(image, base)
+    distance = cv2.max(cv2.max(difference[..., 0], difference[..., 1]), difference[..., 2])
+    weights = np.rint(255 * (1 - np.exp(-0.5 * (np.arange(256) / sigma_color) ** 2))).astype(np.uint8)
+    keep = cv2.LUT(distance, weights)
+
+    detail = cv2.subtract(image, base, dtype=cv2.CV_16S)
+    detail = cv2.multiply(detail, cv2.merge([keep] * 3).astype(np.int16), scale=1 / 255)
+    return cv2.add(filtered, detail, dtype=cv2.CV_8U)
+
+
+class DenoiseFilter:
+    """
+    Filtro de reducción de ruido que se aplica a la imagen antes de convertirla a escala de grises.
+
+    :param name: uno de `DENOISE_FILTERS`
+    :param params: parámetros del filtro; los que no se indiquen toman el valor de `DEFAULT_PARAMS`
+    """
+
+    def __init__(self, name='bilateral', **params):
+        if name not in DENOISE_FILTERS:
+            raise ValueError(f'Filtro desconocido: {name}')
+
+        unknown = set(params) - set(DEFAULT_PARAMS[name])
+        if unknown:
+            raise ValueError(f"Parámetros desconocidos para el filtro {name}: {', '.join(sorted(unknown))}")
+
+        params = {key: parse_filter_value(value, key) for key, value in params.items()}
+        if 'ksize' in params and (params['ksize'] <= 0 or params['ksize'] % 2 == 0):
+            raise ValueError(f"El tamaño del núcleo del filtro {name} debe ser impar y positivo, se recibió "
+                             f"{params['ksize']}")
+        if 'scale' in params and not 0 < params['scale'] <= 1:
+            raise ValueError(f"La escala del filtro {name} debe estar entre 0 (exclusivo) y 1, se recibió "
+                             f"{params['scale']}")
+
+        self.name = name
+        self.params = {**DEFAULT_PARAMS[name], **params}
+
+    def __repr__(self):
+        params = ', '.join(f'{key}={value}' for key, value in self.params.items())
+        return f'DenoiseFilter({self.name!r}{", " if params else ""}{params})'
+
+    def __call__(self, image):
+        p = self.params
+        if self.name == 'bilateral':
+            return cv2.bilateralFilter(image, int(p['diameter']), p['sigma_color'], p['sigma_space'])
+        if self.name == 'fast_bilateral':
+            return fast_bilateral_filter(image, int(p['diameter']), p['sigma_color'], p['sigma_space'], p['scale'])
+        if self.name == 'gaussian':
+            return cv2.GaussianBlur(image, (int(p['ksize']), int(p['ksize'])), 0)
+        if self.name == 'median':
+            return cv2.medianBlur(image, int(p['ksize']))
+        if self.name == 'mean':
+            return cv2.blur(image, (int(p['ksize']), int(p['ksize'])))
+        return image
+
+    @property
+    def signature(self):
+        """Identifica el filtro y sus parámetros (por ejemplo para las claves de `cache.ResultCache`)."""
+
+        return (self.name, tuple(sorted(self.params.items())))
+
+    @property
+    def halo(self):
+        """
+        Margen en píxeles que necesita cada mosaico para que el resultado coincida con el de la imagen
+        completa. En 'fast_bilateral' se cubre el alcance del filtro reducido, pero la reducción de cada
+        mosaico no coincide exactamente con la de la imagen completa, así que el resultado es aproximado.
+        """
+
+        p = self.params
+        if self.name in ('bilateral', 'fast_bilateral'):
+            return int(p['diameter']) // 2 + (math.ceil(2 / p['scale']) if self.name == 'fast_bilateral' else 0)
+        if self.name == 'none':
+            return 0
+        return int(p['ksize']) // 2
+
+
+def select_denoise_filter(config, denoise=None):
+    """
+    Elige el filtro de ruido de una imagen: el indicado en la línea de comandos (`denoise`) tiene prioridad
+    sobre la sección [filter] del archivo de configuración. None deja el filtro del procesador.
+    """
+
+    if denoise is None and config['denoise'] is not None:
+        return DenoiseFilter(config['denoise'], **config['denoise_params'])
+    return denoise
+
+
+def parse_filter_value(value, key=None):
+    """
+    Convierte el valor de un parámetro de filtro en número: los enteros quedan como int (así `ksize=5` de un
+    .ini da la misma `DenoiseFilter.signature` que el valor por defecto) y el resto como float.
+
+    :param value: str o número
+    :param key: nombre del parámetro; los de `INTEGER_PARAMS` deben ser enteros
+    :raises ValueError: si el valor no es un número o `key` exige un entero y no lo es
+    """
+
+    number = float(value)
+    if number.is_integer():
+        return int(number)
+    if key in INTEGER_PARAMS:
+        raise ValueError(f"El parámetro '{key}' debe ser entero, se recibió {value}")
+    return number
+
+
+def parse_filter_params(values):
+    """
+    Convierte parámetros `clave=valor` (de la línea de comandos o de la sección [filter] de un .ini) en un
+    dict de números (ver `parse_filter_value`).
+    """
+
+    params = {}
+    for value in values:
+        key, _, number = value.partition('=')
+        params[key.strip()] = parse_filter_value(number, key.strip())
+
+    return params
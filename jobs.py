@@ -0,0 +1,170 @@
+import os
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import MetricsCollector
+from processor import ThermalImageProcessor
+from utils import generate_pdf_report, load_image_file
+
+# Peso aproximado de cada etapa en el tiempo total, para convertir las etapas en un porcentaje
+STAGE_WEIGHTS = {
+    'apply_denoise_filter': 0.30,
+    'calculate_grayscale_map': 0.30,
+    'calculate_histogram': 0.02,
+    'find_hot_zones': 0.03,
+    'calculate_heat_loss': 0.10,
+    'generate_pdf_report': 0.25,
+}
+
+
+class JobCancelled(Exception):
+    """El análisis se canceló antes de terminar."""
+
+
+class ProgressCollector(MetricsCollector):
+    """
+    Recolector de métricas que además informa el progreso en cada límite de etapa del procesador y
+    detiene el análisis si se pidió cancelarlo.
+    """
+
+    def __init__(self, on_progress, cancel_event):
+        super().__init__()
+        self.on_progress = on_progress
+        self.cancel_event = cancel_event
+        self.progress = 0.0
+
+    @contextmanager
+    def stage(self, name):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+        self.on_progress(name, self.progress)
+        with super().stage(name):
+            yield
+
+        # Las etapas que se repiten (modo por mosaicos) no deben llegar al 100% antes de terminar
+        self.progress = min(self.progress + STAGE_WEIGHTS.get(name, 0), 0.99)
+        self.on_progress(name, self.progress)
+
+
+class AnalysisJob:
+    """Análisis de una imagen en la cola. `cancel` lo quita de la cola o lo detiene en la próxima etapa."""
+
+    def __init__(self, image_path, output_folder):
+        self.image_path = image_path
+        self.output_folder = output_folder
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    def cancel(self):
+        """
+        :return: True si el análisis aún no había empezado y se quitó de la cola; si ya estaba en marcha se
+            detiene en el próximo límite de etapa y se notifica con `JobCancelled`
+        """
+
+        self.cancel_event.set()
+        return self.future is not None and self.future.cancel()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+
+class AnalysisQueue:
+    """
+    Cola de análisis que se ejecutan en hilos en segundo plano. OpenCV y NumPy liberan el GIL, así que la
+    interfaz sigue respondiendo mientras se procesa. Cada hilo reutiliza su propio procesador; con `cache`
+    (`cache.ResultCache`) repetir un análisis cambiando solo las constantes físicas no vuelve a procesar la imagen.
+    """
+
+    def __init__(self, workers=1, lut_bits=None, zone_engine='contours', cache=None, zone_workers=1):
+        self.lut_bits = lut_bits
+        self.zone_engine = zone_engine
+        self.zone_workers = zone_workers
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analysis')
+        self._local = threading.local()
+        self._jobs = set()
+        self._processors = []
+        self._lock = threading.Lock()
+
+    def _processor(self):
+        if not hasattr(self._local, 'processor'):
+            self._local.processor = ThermalImageProcessor(self.lut_bits, self.zone_engine, cache=self.cache,
+                                                          zone_workers=self.zone_workers)
+            with self._lock:
+                self._processors.append(self._local.processor)
+        return self._local.processor
+
+    def submit(self, image_path, parameters, output_folder, on_progress, on_done, on_error):
+        """
+        Agrega una imagen a la cola.
+
+        :param parameters: tuple con los argumentos de `ThermalImageProcessor.process` después de la imagen
+        :param on_progress: callback(job, etapa, fracción entre 0 y 1)
+        :param on_done: callback(job, resultado de `process`)
+        :param on_error: callback(job, excepción); recibe `JobCancelled` si se canceló
+        :return: `AnalysisJob`
+        """
+
+        job = AnalysisJob(image_path, output_folder)
+        with self._lock:
+            self._jobs.add(job)
+        job.future = self.executor.submit(self._run, job, parameters, on_progress, on_done, on_error)
+        job.future.add_done_callback(lambda _: self._forget(job))
+        return job
+
+    def _forget(self, job):
+        with self._lock:
+            self._jobs.discard(job)
+
+    def _run(self, job, parameters, on_progress, on_done, on_error):
+        try:
+            if job.cancelled:
+                raise JobCancelled()
+
+            processor = self._processor()
+            processor.collector = ProgressCollector(lambda stage, fraction: on_progress(job, stage, fraction),
+                                                    job.cancel_event)
+
+            image = load_image_file(job.image_path)
+            if image is None:
+                raise ValueError(f'No se pudo leer la imagen {job.image_path}')
+
+            result = processor.process(image, *parameters)
+            os.makedirs(job.output_folder, exist_ok=True)
+            with processor.measure_stage('generate_pdf_report'):
+                generate_pdf_report(result.zones, result.histogram, job.output_folder, workers=processor.zone_workers)
+        except Exception as ex:
+            on_error(job, ex)
+            return
+
+        on_progress(job, 'done', 1.0)
+        on_done(job, result)
+
+    def shutdown(self, wait=True):
+        """
+        Cancela los análisis pendientes, detiene los que están en marcha en su próximo límite de etapa y
+        detiene los hilos, también los de zonas de cada procesador. Con `wait` espera a que terminen, de modo
+        que ningún reporte quede a medias; sin `wait` los procesadores se cierran en segundo plano cuando
+        terminan los análisis en curso.
+        """
+
+        with self._lock:
+            jobs = list(self._jobs)
+        for job in jobs:
+            job.cancel()
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+        if wait:
+            self._close_processors()
+        else:
+            threading.Thread(target=self._close_processors, name='analysis-shutdown', daemon=True).start()
+
+    def _close_processors(self):
+        self.executor.shutdown(wait=True)
+        with self._lock:
+            processors, self._processors = self._processors, []
+        for processor in processors:
+            processor.close()
@@ -0,0 +1,151 @@
+import sys
+import json
+import time
+import argparse
+import platform
+import threading
+import configparser as cp
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from utils import find_image_pairs
+from server import create_server
+
+
+def request_query(config_path, threshold_hot=200, pdf=False):
+    """Parámetros de `POST /analyze` equivalentes a un archivo .ini (ver `server.parse_request_config`)."""
+
+    config = cp.ConfigParser()
+    config.read(config_path)
+    query = dict(config.items('parameters'))
+    for section in ('filter', 'palette'):
+        if config.has_section(section):
+            query.update({f'{section}.{key}': value for key, value in config.items(section)})
+    query['threshold_hot'] = threshold_hot
+    if pdf:
+        query['pdf'] = 1
+    return urlencode(query)
+
+
+def post(url, body):
+    """
+    :return: tuple (código HTTP, latencia en segundos)
+    """
+
+    request = Request(url, data=body, method='POST', headers={'Content-Type': 'application/octet-stream'})
+    start = time.perf_counter()
+    try:
+        with urlopen(request) as response:
+            response.read()
+            status = response.status
+    except HTTPError as ex:
+        ex.read()
+        status = ex.code
+    return status, time.perf_counter() - start
+
+
+def latency_stats(latencies):
+    latencies = np.array(latencies)
+    if not len(latencies):
+        return None
+    return {
+        'mean': float(latencies.mean()),
+        'min': float(latencies.min()),
+        'max': float(latencies.max()),
+        'p50': float(np.percentile(latencies, 50)),
+        'p90': float(np.percentile(latencies, 90)),
+        'p99': float(np.percentile(latencies, 99)),
+    }
+
+
+def run(base_url, pairs, requests, concurrency, threshold_hot=200, pdf=False):
+    """
+    Envía `requests` peticiones (recorriendo las parejas imagen/.ini en orden) desde `concurrency` clientes
+    simultáneos y mide la latencia de las respuestas correctas, el rendimiento y las rechazadas con 503.
+    """
+
+    bodies = []
+    for image_path, config_path in pairs:
+        with open(image_path, 'rb') as f:
+            bodies.append((f"{base_url}/analyze?{request_query(config_path, threshold_hot, pdf)}", f.read()))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        responses = list(executor.map(lambda i: post(*bodies[i % len(bodies)]), range(requests)))
+    elapsed = time.perf_counter() - start
+
+    statuses = {}
+    for status, _ in responses:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    ok = [latency for status, latency in responses if status == 200]
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'pdf': pdf,
+        'statuses': statuses,
+        'rejected': statuses.get('503', 0),
+        'elapsed': elapsed,
+        'throughput': len(ok) / elapsed,
+        'latency': latency_stats(ok),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prueba de carga (latencia y rendimiento) de server.py')
+    parser.add_argument('-d', '--input-folder', help='Carpeta con parejas imagen/.ini', required=False,
+                        default='caldera')
+    parser.add_argument('--url', help='Servicio ya en marcha (por defecto se inicia uno local en un puerto libre)',
+                        required=False, default=None)
+    parser.add_argument('-n', '--requests', type=int, help='Número de peticiones', required=False, default=100)
+    parser.add_argument('-c', '--concurrency', type=int, nargs='+', help='Clientes simultáneos a comparar',
+                        required=False, default=[1, 4, 16])
+    parser.add_argument('-w', '--workers', type=int, help='Análisis simultáneos del servicio local', required=False,
+                        default=2)
+    parser.add_argument('-q', '--queue-size', type=int, help='Análisis en espera del servicio local', required=False,
+                        default=8)
+    parser.add_argument('-th', '--threshold-hot', type=int, help='Threshold utilizado', required=False, default=200)
+    parser.add_argument('--pdf', action='store_true', help='Pedir también el reporte PDF')
+    parser.add_argument('-o', '--output', help='Archivo JSON de resultados (por defecto stdout)')
+    args = parser.parse_args()
+
+    pairs = find_image_pairs(args.input_folder)
+    if not pairs:
+        parser.error(f'No hay parejas imagen/.ini en {args.input_folder}')
+
+    httpd = None
+    url = args.url
+    if url is None:
+        httpd = create_server(port=0, quiet=True, workers=args.workers, queue_size=args.queue_size)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{httpd.server_address[1]}'
+
+    try:
+        results = [run(url.rstrip('/'), pairs, args.requests, concurrency, args.threshold_hot, args.pdf)
+                   for concurrency in args.concurrency]
+    finally:
+        if httpd is not None:
+            httpd.shutdown()
+            httpd.server_close()
+            httpd.service.shutdown()
+
+    for result in results:
+        latency = result['latency'] or {}
+        print(f"{result['concurrency']:>4} clientes  {result['throughput']:8.1f} img/s  "
+              f"p50 {latency.get('p50', 0) * 1000:7.1f} ms  p99 {latency.get('p99', 0) * 1000:7.1f} ms  "
+              f"rechazadas {result['rejected']}", file=sys.stderr)
+
+    report = {
+        'meta': {'python': platform.python_version(), 'url': url, 'workers': None if args.url else args.workers,
+                 'queue_size': None if args.url else args.queue_size},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
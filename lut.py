@@ -0,0 +1,165 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+
+from settings import LUT_CACHE_DIR
+from utils import nearest_palette_values
+
+# Medidas del error de una tabla cuantizada guardadas junto a ella (ver `quantization_error`)
+ERROR_KEYS = ('max_error', 'mean_error', 'p99_error')
+
+# Evita que varios hilos del mismo proceso construyan a la vez la misma tabla (reentrante porque la tabla
+# cuantizada carga la exacta)
+_build_lock = threading.RLock()
+
+
+def palette_hash(colors, values):
+    """
+    Calcula una huella de la paleta para identificar su tabla de búsqueda en la caché.
+
+    :param colors: np.ndarray (N, 3) con los colores de la paleta
+    :param values: np.ndarray (N,) con los valores en escala de grises
+    :return: str
+    """
+
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(colors, dtype=np.int32).tobytes())
+    digest.update(np.ascontiguousarray(values, dtype=np.uint8).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def build_lut(colors, values, bits=8):
+    """
+    Construye la tabla densa color -> gris con `bits` bits por canal.
+
+    Con 8 bits cada entrada coincide exactamente con `nearest_color`. Con menos bits cada celda toma el
+    valor del color central de la celda.
+
+    :param colors: np.ndarray (N, 3) con los colores de la paleta
+    :param values: np.ndarray (N,) con los valores en escala de grises
+    :param bits: int entre 1 y 8
+    :return: np.ndarray (2**bits, 2**bits, 2**bits) uint8 indexado como lut[c0, c1, c2]
+    """
+
+    if not 1 <= bits <= 8:
+        raise ValueError(f'bits debe estar entre 1 y 8, se recibió {bits}')
+
+    levels = 1 << bits
+    shift = 8 - bits
+    centers = (np.arange(levels, dtype=np.int32) << shift) + ((1 << shift) >> 1)
+    c1, c2 = np.meshgrid(centers, centers, indexing='ij')
+    plane = np.stack([np.zeros_like(c1), c1, c2], axis=-1).reshape(-1, 3)
+
+    lut = np.empty((levels, levels, levels), dtype=np.uint8)
+    for i, c0 in enumerate(centers):
+        plane[:, 0] = c0
+        lut[i] = nearest_palette_values(plane, colors, values).reshape(levels, levels)
+
+    return lut
+
+
+def quantization_error(lut, strict_lut):
+    """
+    Calcula el error en niveles de gris de una tabla cuantizada respecto a la tabla exacta sobre todos los
+    colores posibles.
+
+    El máximo lo marcan unos pocos colores en las fronteras entre tramos lejanos de la paleta, así que por sí
+    solo no sirve para elegir los bits; la media y el percentil 99 indican cuántos colores se ven afectados.
+
+    :param lut: np.ndarray (L, L, L) uint8
+    :param strict_lut: np.ndarray (256, 256, 256) uint8
+    :return: dict con las claves de `ERROR_KEYS`
+    """
+
+    levels = lut.shape[0]
+    step = 256 // levels
+    counts = np.zeros(256, dtype=np.int64)
+    for i in range(levels):
+        block = np.asarray(strict_lut[i * step:(i + 1) * step], dtype=np.int16)
+        block = block.reshape(step, levels, step, levels, step)
+        error = np.abs(block - lut[i].astype(np.int16)[np.newaxis, :, np.newaxis, :, np.newaxis])
+        counts += np.bincount(error.ravel(), minlength=256)
+
+    cumulative = np.cumsum(counts) / counts.sum()
+    return {
+        'max_error': int(np.flatnonzero(counts)[-1]),
+        'mean_error': float(counts @ np.arange(256) / counts.sum()),
+        'p99_error': int(np.searchsorted(cumulative, 0.99)),
+    }
+
+
+def _write_atomic(path, mode, write):
+    """Escribe un archivo a través de un temporal para que otros procesos o hilos nunca lean uno a medias."""
+
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, mode) as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def _read_meta(lut_path, meta_path):
+    """
+    :return: dict con los metadatos de una tabla guardada, o None si falta o se guardó antes de medir la media
+        y el percentil del error (en ese caso se reconstruye)
+    """
+
+    if not (os.path.exists(lut_path) and os.path.exists(meta_path)):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return meta if all(key in meta for key in ERROR_KEYS) else None
+
+
+def load_lut(colors, values, bits=8, cache_dir=LUT_CACHE_DIR):
+    """
+    Devuelve la tabla de búsqueda de la paleta, construyéndola y guardándola en caché si no existe.
+
+    La tabla se abre mapeada en memoria, así que el arranque no la reconstruye ni la copia.
+
+    :param colors: np.ndarray (N, 3) con los colores de la paleta
+    :param values: np.ndarray (N,) con los valores en escala de grises
+    :param bits: int, 8 para el modo exacto o menos para el modo cuantizado
+    :param cache_dir: str
+    :return: tuple (lut, dict con el error en niveles de gris de `quantization_error`; todo 0 con 8 bits)
+    """
+
+    os.makedirs(cache_dir, exist_ok=True)
+    name = f'lut_{palette_hash(colors, values)}_{bits}b'
+    lut_path = os.path.join(cache_dir, f'{name}.npy')
+    meta_path = os.path.join(cache_dir, f'{name}.json')
+
+    meta = _read_meta(lut_path, meta_path)
+    if meta is None:
+        with _build_lock:
+            # Otro hilo pudo guardarla mientras se esperaba el candado
+            meta = _read_meta(lut_path, meta_path)
+            if meta is None:
+                lut = build_lut(colors, values, bits)
+                errors = dict.fromkeys(ERROR_KEYS, 0)
+                if bits < 8:
+                    strict_lut, _ = load_lut(colors, values, 8, cache_dir)
+                    errors = quantization_error(lut, strict_lut)
+
+                meta = {'bits': bits, **errors}
+                _write_atomic(lut_path, 'wb', lambda f: np.save(f, lut))
+                _write_atomic(meta_path, 'w', lambda f: json.dump(meta, f))
+
+    return np.load(lut_path, mmap_mode='r'), {key: meta[key] for key in ERROR_KEYS}
+
+
+def apply_lut(image, lut):
+    """
+    Calcula el mapa en escala de grises de una imagen con una única indexación de la tabla.
+
+    :param image: np.ndarray (alto, ancho, 3) uint8
+    :param lut: np.ndarray (L, L, L) uint8
+    :return: np.ndarray (alto, ancho) uint8
+    """
+
+    shift = 8 - (lut.shape[0].bit_length() - 1)
+    if shift:
+        image = image >> shift
+
+    return lut[image[..., 0], image[..., 1], image[..., 2]]
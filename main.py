@@ -1,36 +1,458 @@
 import os
+import csv
+import json
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from utils import generate_pdf_report, measure_execution_time, load_image_file, load_config_file
-from processor import ThermalImageProcessor
+from settings import CO, PALETTE
+from utils import generate_pdf_report, measure_execution_time, load_image_file, load_config_file, celsius_to_kelvin
+from utils import interpolate_palette, palette_to_arrays, find_image_pairs
+from lut import load_lut
+from cache import ResultCache
+from export import EXPORT_FORMATS, zone_records, zone_geometry, export_zones
+from filters import DENOISE_FILTERS, DenoiseFilter, parse_filter_params, select_denoise_filter
+from metrics import MetricsCollector
+from palette import COLORBAR_HOT_ENDS, calibrate_palette, parse_region
+from processor import ThermalImageProcessor, ZONE_ENGINES, SEGMENTATIONS
+from video import iter_frames, process_frames, write_time_series
 
+SUMMARY_FIELDS = ['image', 'config', 'zones', 'total_area', 'total_heat_loss', 'report', 'error']
+SWEEP_FIELDS = ['threshold', 'zones', 'total_area', 'total_heat_loss']
 
-@measure_execution_time
-def process(image_path, config_path, threshold_hot, output_folder):
+# Opciones de la línea de comandos que se pasan tal cual a `ThermalImageProcessor`
+PROCESSOR_OPTIONS = ('lut_bits', 'zone_engine', 'segmentation', 'region_tolerance', 'min_zone_area', 'top_zones',
+                     'zone_workers')
+
+# Procesador reutilizado por todas las imágenes de un proceso trabajador del modo batch
+_worker_processor = None
+
+
+def processor_options(args):
     """
-    Realizar procesamiento de una imagen térmica
+    Reúne las opciones de `ThermalImageProcessor` de la línea de comandos (las de `PROCESSOR_OPTIONS` que
+    admite el subcomando) en un dict de argumentos por nombre.
+    """
+
+    return {name: getattr(args, name) for name in PROCESSOR_OPTIONS if hasattr(args, name)}
+
+
+def analyze_image(thermal_processor, image_path, config_path, threshold_hot, output_folder, *, tile_size=None,
+                  denoise=None, pdf=True, colorbar=None):
+    """
+    Procesa una imagen térmica con su archivo de configuración y, salvo que `pdf` sea False, genera su
+    reporte PDF. Con `tile_size` la imagen se procesa por mosaicos (ver `ThermalImageProcessor.process_tiled`).
+    Si hay barra de colores la paleta se lee de la imagen (ver `calibrate_palette`).
+
+    :return: `ProcessResult` del procesador
     """
 
     # Crear carpeta de salida si no existe
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    # Procesar la imagen térmica
-    thermal_processor = ThermalImageProcessor()
     image = load_image_file(image_path)
+    if image is None:
+        raise ValueError(f'No se pudo leer la imagen {image_path}')
+
     config = load_config_file(config_path)
-    data, histogram = thermal_processor.process(threshold_hot)
+    # La barra de colores se tapa para que no se detecte como zona caliente
+    palette = calibrate_palette(thermal_processor, image, config, colorbar)
+    if palette is not None:
+        image = palette.mask(image)
+    args = (
+        image,
+        config['fuel_flow'],
+        config['heat_transfer_coeff'],
+        celsius_to_kelvin(config['ambient_temp']),
+        CO,
+        config['boiler_width_m'],
+        config['boiler_width_px'],
+        celsius_to_kelvin(config['min_temp']),
+        celsius_to_kelvin(config['max_temp']),
+        threshold_hot,
+    )
+    denoise = select_denoise_filter(config, denoise)
+    if tile_size:
+        result = thermal_processor.process_tiled(*args, tile_size=tile_size, denoise=denoise)
+    else:
+        result = thermal_processor.process(*args, denoise=denoise)
 
     # Generar reporte PDF
-    generate_pdf_report(data, histogram, output_folder)
+    if pdf:
+        with thermal_processor.measure_stage('generate_pdf_report'):
+            generate_pdf_report(result.zones, result.histogram, output_folder, workers=thermal_processor.zone_workers)
+
+    if result.metrics is not None:
+        result.metrics['image'] = image_path
+    return result
+
+
+def zone_export_entry(thermal_processor, result, image_path):
+    """
+    Filas y geometría de las zonas de una imagen para `export.export_zones`. Solo contienen números y
+    arrays, así que se pueden devolver desde un proceso trabajador sin enviar la imagen.
+    """
+
+    with thermal_processor.measure_stage('export_zones'):
+        return zone_records(result.zones, image_path), zone_geometry(result.zones, image_path)
+
+
+@measure_execution_time
+def process(image_path, config_path, threshold_hot, output_folder, *, metrics_file=None, tile_size=None,
+            use_cache=True, denoise=None, formats=(), pdf=True, colorbar=None, options=None):
+    """
+    Realizar procesamiento de una imagen térmica. Con `formats` las zonas se agregan además a
+    `output_folder/zonas.<formato>` (ver `export.export_zones`).
+
+    :param options: dict con los argumentos por nombre de `ThermalImageProcessor` (ver `processor_options`)
+    """
+
+    collector = MetricsCollector() if metrics_file else None
+    cache = ResultCache() if use_cache else None
+    with ThermalImageProcessor(collector=collector, cache=cache, **(options or {})) as thermal_processor:
+        result = analyze_image(thermal_processor, image_path, config_path, threshold_hot, output_folder,
+                               tile_size=tile_size, denoise=denoise, pdf=pdf, colorbar=colorbar)
+        if formats:
+            export_zones([zone_export_entry(thermal_processor, result, image_path)], output_folder, formats)
+
+    if collector is not None:
+        collector.to_jsonl(metrics_file)
+
+
+def _init_worker(collect_metrics, use_cache, options):
+    """Crea un único procesador (y su paleta) por proceso trabajador."""
+
+    global _worker_processor
+    _worker_processor = ThermalImageProcessor(collector=MetricsCollector() if collect_metrics else None,
+                                              cache=ResultCache() if use_cache else None, **options)
+
+
+def _batch_job(image_path, config_path, threshold_hot, output_folder, *, tile_size=None, denoise=None, formats=(),
+               pdf=True, colorbar=None):
+    """
+    Procesa una pareja del modo batch y devuelve su fila del resumen. Los errores se registran en la fila
+    para que el resto del lote continúe.
+    """
+
+    row = {'image': image_path, 'config': config_path}
+    try:
+        result = analyze_image(_worker_processor, image_path, config_path, threshold_hot, output_folder,
+                               tile_size=tile_size, denoise=denoise, pdf=pdf, colorbar=colorbar)
+        if formats:
+            row['export'] = zone_export_entry(_worker_processor, result, image_path)
+    except Exception as ex:
+        row['error'] = f'{type(ex).__name__}: {ex}'
+        return row
+    finally:
+        if _worker_processor.collector is not None:
+            _worker_processor.collector.records.clear()
+
+    data = result.zones
+    row['metrics'] = result.metrics
+
+    row['zones'] = len(data)
+    row['total_area'] = sum(zone.area for zone in data)
+    row['total_heat_loss'] = sum(zone.heat_loss for zone in data)
+    if pdf:
+        row['report'] = os.path.join(output_folder, 'reporte_zonas_calientes.pdf')
+    return row
+
+
+@measure_execution_time
+def batch(input_folder, threshold_hot, output_folder, *, workers=None, metrics_file=None, tile_size=None,
+          use_cache=True, denoise=None, formats=(), pdf=True, colorbar=None, options=None):
+    """
+    Procesa en paralelo todas las parejas imagen/configuración de una carpeta. Cada imagen genera su
+    reporte en `output_folder/<nombre>` (salvo que `pdf` sea False) y el lote completo un `summary.csv`. Con
+    `formats` las zonas de todas las imágenes se agregan, ordenadas por imagen, a `output_folder/zonas.<formato>`.
+    Si se indica `metrics_file` se agregan a ese archivo las métricas de cada imagen como JSON lines.
+
+    :param options: dict con los argumentos por nombre de `ThermalImageProcessor` (ver `processor_options`)
+    """
+
+    pairs = find_image_pairs(input_folder)
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
+
+    # La tabla de búsqueda se construye aquí una sola vez: el candado de `lut.load_lut` no cubre varios
+    # procesos, y así los trabajadores solo abren la tabla guardada mapeada en memoria
+    options = options or {}
+    if options.get('lut_bits') is not None:
+        load_lut(*palette_to_arrays(interpolate_palette(PALETTE)), options['lut_bits'])
+
+    rows = []
+    initargs = (bool(metrics_file), use_cache, options)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+        futures = [
+            executor.submit(_batch_job, image_path, config_path, threshold_hot,
+                            os.path.join(output_folder, os.path.splitext(os.path.basename(image_path))[0]),
+                            tile_size=tile_size, denoise=denoise, formats=formats, pdf=pdf, colorbar=colorbar)
+            for image_path, config_path in pairs
+        ]
+        for future in as_completed(futures):
+            row = future.result()
+            print(f"{row['image']}: {row.get('error') or 'OK'}")
+            rows.append(row)
+
+            if metrics_file and row.get('metrics'):
+                with open(metrics_file, 'a') as f:
+                    f.write(json.dumps(row['metrics']) + '\n')
+
+    rows.sort(key=lambda r: r['image'])
+    with open(os.path.join(output_folder, 'summary.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+    if formats:
+        export_zones([row['export'] for row in rows if 'export' in row], output_folder, formats)
+
+    failed = sum(1 for row in rows if row.get('error'))
+    print(f'{len(rows) - failed} imágenes procesadas, {failed} con errores')
+    return rows
+
+
+def calibrated_frames(thermal_processor, frames, config, colorbar=None):
+    """
+    Lee la paleta de la barra de colores del primer cuadro (ver `calibrate_palette`) y tapa la barra en
+    todos los cuadros, para que la misma paleta sirva para toda la grabación.
+    """
+
+    palette = None
+    for count, (index, timestamp, frame) in enumerate(frames):
+        if count == 0:
+            palette = calibrate_palette(thermal_processor, frame, config, colorbar)
+        if palette is not None:
+            frame = palette.mask(frame)
+        yield index, timestamp, frame
+
+
+@measure_execution_time
+def video(source, config_path, threshold_hot, output_file, *, tile_size=64, fps=None, metrics_file=None,
+          denoise=None, colorbar=None, options=None):
+    """
+    Procesa una grabación o una carpeta de cuadros y guarda la serie temporal de pérdidas por cuadro en
+    `output_file` (CSV o `.npz`) en lugar de un reporte PDF por cuadro.
+
+    :param options: dict con los argumentos por nombre de `ThermalImageProcessor`; el motor de zonas es
+        siempre 'components'
+    """
+
+    config = load_config_file(config_path)
+    collector = MetricsCollector() if metrics_file else None
+    thermal_processor = ThermalImageProcessor(**{**(options or {}), 'zone_engine': 'components'},
+                                              collector=collector, denoise=select_denoise_filter(config, denoise))
+    if collector is not None:
+        collector.start(image=source)
+
+    output_dir = os.path.dirname(output_file)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    rows = process_frames(
+        thermal_processor,
+        calibrated_frames(thermal_processor, iter_frames(source, fps), config, colorbar),
+        config['fuel_flow'],
+        config['heat_transfer_coeff'],
+        celsius_to_kelvin(config['ambient_temp']),
+        CO,
+        config['boiler_width_m'],
+        config['boiler_width_px'],
+        celsius_to_kelvin(config['min_temp']),
+        celsius_to_kelvin(config['max_temp']),
+        threshold_hot,
+        tile_size,
+    )
+    count = write_time_series(rows, output_file)
+    print(f'{count} cuadros procesados')
+
+    if collector is not None:
+        collector.to_jsonl(metrics_file)
+
+
+def parse_thresholds(values):
+    """
+    Convierte los umbrales de la línea de comandos en una lista. Cada valor es un umbral (`200`) o un rango
+    `inicio:fin[:paso]` con el fin incluido (`150:250:10`).
+    """
+
+    thresholds = []
+    for value in values:
+        if ':' in value:
+            start, stop, *step = (int(v) for v in value.split(':'))
+            thresholds.extend(range(start, stop + 1, step[0] if step else 1))
+        else:
+            thresholds.append(int(value))
+
+    return thresholds
+
+
+@measure_execution_time
+def sweep(image_path, config_path, thresholds, output_file=None, *, denoise=None, colorbar=None, options=None):
+    """
+    Evalúa varios umbrales de zonas calientes sobre una imagen y muestra (o guarda en `output_file` como CSV)
+    el número de zonas, el área total y la pérdida de calor total de cada uno.
+
+    :param options: dict con los argumentos por nombre de `ThermalImageProcessor` (ver `processor_options`)
+    """
+
+    image = load_image_file(image_path)
+    if image is None:
+        raise ValueError(f'No se pudo leer la imagen {image_path}')
+
+    config = load_config_file(config_path)
+    with ThermalImageProcessor(**(options or {})) as thermal_processor:
+        palette = calibrate_palette(thermal_processor, image, config, colorbar)
+        if palette is not None:
+            image = palette.mask(image)
+        rows = thermal_processor.sweep_thresholds(
+            image,
+            config['fuel_flow'],
+            config['heat_transfer_coeff'],
+            celsius_to_kelvin(config['ambient_temp']),
+            CO,
+            config['boiler_width_m'],
+            config['boiler_width_px'],
+            celsius_to_kelvin(config['min_temp']),
+            celsius_to_kelvin(config['max_temp']),
+            thresholds,
+            select_denoise_filter(config, denoise),
+        )
+
+    if output_file:
+        with open(output_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=SWEEP_FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        print(f"{'umbral':>7} {'zonas':>6} {'área [m2]':>12} {'pérdida de calor':>18}")
+        for row in rows:
+            print(f"{row['threshold']:>7} {row['zones']:>6} {row['total_area']:>12.4f} {row['total_heat_loss']:>18.4f}")
+
+    return rows
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Procesamiento de imágenes térmicas')
-    parser.add_argument('-i', '--image-file', help='Archivo de imagen térmica', required=True)
-    parser.add_argument('-c', '--config-file', help='Archivo de configuración', required=True)
-    parser.add_argument('-o', '--output-folder', help='Carpeta de salida', required=False, default='output')
-    parser.add_argument('-th', '--threshold-hot', type=int, help='Threshold utilizado', required=False, default=200)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    denoise_options = argparse.ArgumentParser(add_help=False)
+    denoise_options.add_argument('--denoise', choices=DENOISE_FILTERS, required=False, default=None,
+                                 help='Filtro de ruido (por defecto el de la sección [filter] del .ini o bilateral)')
+    denoise_options.add_argument('--denoise-params', nargs='+', metavar='CLAVE=VALOR', required=False, default=[],
+                                 help='Parámetros del filtro, por ejemplo scale=0.5 o ksize=5')
+
+    segmentation_options = argparse.ArgumentParser(add_help=False)
+    segmentation_options.add_argument('--segmentation', choices=SEGMENTATIONS, required=False, default='threshold',
+                                      help='Segmentación de zonas: umbral o crecimiento de regiones desde los '
+                                           'máximos locales por encima del umbral')
+    segmentation_options.add_argument('--region-tolerance', type=int, required=False, default=10,
+                                      help='Diferencia de gris máxima con la semilla al crecer regiones')
+
+    palette_options = argparse.ArgumentParser(add_help=False)
+    palette_options.add_argument('--colorbar', metavar='X,Y,ANCHO,ALTO', required=False, default=None,
+                                 help='Región de la barra de colores de la cámara de la que leer la paleta '
+                                      '(por defecto la de la sección [palette] del .ini o settings.PALETTE)')
+    palette_options.add_argument('--hot-end', choices=COLORBAR_HOT_ENDS, required=False, default=None,
+                                 help='Extremo caliente de la barra (por defecto arriba o a la derecha)')
+    palette_options.add_argument('--camera', required=False, default=None,
+                                 help='Modelo de cámara con el que guardar la paleta en caché; sin él la barra '
+                                      'de cada imagen se compara con la paleta guardada')
+
+    min_area_options = argparse.ArgumentParser(add_help=False)
+    min_area_options.add_argument('--min-zone-area', type=float, required=False, default=0.0,
+                                  help='Área mínima de una zona en m²; las menores se descartan antes de medirlas')
+
+    zone_options = argparse.ArgumentParser(add_help=False, parents=[segmentation_options, min_area_options])
+    zone_options.add_argument('--top-zones', type=int, required=False, default=None,
+                              help='Conservar solo las N zonas de mayor pérdida de calor, de mayor a menor')
+    zone_options.add_argument('--zone-workers', type=int, required=False, default=1,
+                              help='Hilos para medir las zonas de cada imagen y codificar sus miniaturas')
+
+    common = argparse.ArgumentParser(add_help=False, parents=[denoise_options, zone_options, palette_options])
+    common.add_argument('-o', '--output-folder', help='Carpeta de salida', required=False, default='output')
+    common.add_argument('-th', '--threshold-hot', type=int, help='Threshold utilizado', required=False, default=200)
+    common.add_argument('--lut-bits', type=int, help='Usar tabla de búsqueda en caché con estos bits por canal',
+                        required=False, default=None)
+    common.add_argument('--metrics', help='Archivo JSON lines donde agregar las métricas de cada imagen',
+                        required=False, default=None)
+    common.add_argument('--tile-size', type=int, help='Procesar por mosaicos de este lado (imágenes muy grandes)',
+                        required=False, default=None)
+    common.add_argument('--zone-engine', choices=ZONE_ENGINES, help='Motor de medición de zonas', required=False,
+                        default='contours')
+    common.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help='No leer ni guardar resultados intermedios en la caché')
+    common.add_argument('--format', dest='formats', nargs='+', choices=EXPORT_FORMATS, required=False, default=[],
+                        help='Agregar las zonas a output/zonas.<formato>: csv o jsonl (medidas) y npz (geometría)')
+    common.add_argument('--no-pdf', dest='pdf', action='store_false', help='No generar el reporte PDF')
+
+    process_parser = subparsers.add_parser('process', parents=[common], help='Procesar una imagen')
+    process_parser.add_argument('-i', '--image-file', help='Archivo de imagen térmica', required=True)
+    process_parser.add_argument('-c', '--config-file', help='Archivo de configuración', required=True)
+
+    batch_parser = subparsers.add_parser('batch', parents=[common], help='Procesar una carpeta de imágenes')
+    batch_parser.add_argument('-d', '--input-folder', help='Carpeta con parejas imagen/.ini', required=True)
+    batch_parser.add_argument('-w', '--workers', type=int, help='Número de procesos', required=False, default=None)
+
+    video_parser = subparsers.add_parser('video', parents=[denoise_options, min_area_options, palette_options],
+                                         help='Procesar una grabación o una carpeta de cuadros')
+    video_parser.add_argument('-i', '--source', help='Archivo de video o carpeta de cuadros', required=True)
+    video_parser.add_argument('-c', '--config-file', help='Archivo de configuración', required=True)
+    video_parser.add_argument('-o', '--output-file', help='Serie temporal de salida (.csv o .npz)',
+                              required=False, default=os.path.join('output', 'serie_temporal.csv'))
+    video_parser.add_argument('-th', '--threshold-hot', type=int, help='Threshold utilizado', required=False,
+                              default=200)
+    video_parser.add_argument('--lut-bits', type=int, help='Usar tabla de búsqueda en caché con estos bits por canal',
+                              required=False, default=None)
+    video_parser.add_argument('--tile-size', type=int, help='Lado de los mosaicos que se comparan entre cuadros',
+                              required=False, default=64)
+    video_parser.add_argument('--fps', type=float, help='Cuadros por segundo de una carpeta de cuadros',
+                              required=False, default=None)
+    video_parser.add_argument('--metrics', help='Archivo JSON lines donde agregar las métricas de la grabación',
+                              required=False, default=None)
+
+    sweep_parser = subparsers.add_parser('sweep', parents=[denoise_options, zone_options, palette_options],
+                                         help='Comparar varios umbrales sobre una imagen')
+    sweep_parser.add_argument('-i', '--image-file', help='Archivo de imagen térmica', required=True)
+    sweep_parser.add_argument('-c', '--config-file', help='Archivo de configuración', required=True)
+    sweep_parser.add_argument('-t', '--thresholds', nargs='+', help='Umbrales o rangos inicio:fin[:paso]',
+                              required=False, default=['150:250:10'])
+    sweep_parser.add_argument('-o', '--output-file', help='Archivo CSV de resultados (por defecto se muestran)',
+                              required=False, default=None)
+    sweep_parser.add_argument('--lut-bits', type=int, help='Usar tabla de búsqueda en caché con estos bits por canal',
+                              required=False, default=None)
+    sweep_parser.add_argument('--zone-engine', choices=ZONE_ENGINES, help='Motor de medición de zonas',
+                              required=False, default='contours')
+
     args = parser.parse_args()
 
-    process(args.image_file, args.config_file, args.threshold_hot, args.output_folder)
+    denoise = None
+    if args.denoise:
+        try:
+            denoise = DenoiseFilter(args.denoise, **parse_filter_params(args.denoise_params))
+        except ValueError as ex:
+            parser.error(f'--denoise-params: {ex}')
+    elif args.denoise_params:
+        parser.error('--denoise-params requiere --denoise')
+
+    colorbar = None
+    if args.colorbar:
+        colorbar = {'region': parse_region(args.colorbar), 'hot_end': args.hot_end, 'camera': args.camera}
+    elif args.hot_end or args.camera:
+        parser.error('--hot-end y --camera requieren --colorbar')
+
+    options = processor_options(args)
+    if args.command == 'sweep':
+        sweep(args.image_file, args.config_file, parse_thresholds(args.thresholds), args.output_file,
+              denoise=denoise, colorbar=colorbar, options=options)
+    elif args.command == 'video':
+        video(args.source, args.config_file, args.threshold_hot, args.output_file, tile_size=args.tile_size,
+              fps=args.fps, metrics_file=args.metrics, denoise=denoise, colorbar=colorbar, options=options)
+    elif args.command == 'batch':
+        batch(args.input_folder, args.threshold_hot, args.output_folder, workers=args.workers,
+              metrics_file=args.metrics, tile_size=args.tile_size, use_cache=args.use_cache, denoise=denoise,
+              formats=args.formats, pdf=args.pdf, colorbar=colorbar, options=options)
+    else:
+        process(args.image_file, args.config_file, args.threshold_hot, args.output_folder,
+                metrics_file=args.metrics, tile_size=args.tile_size, use_cache=args.use_cache, denoise=denoise,
+                formats=args.formats, pdf=args.pdf, colorbar=colorbar, options=options)
@@ -0,0 +1,68 @@
+import json
+import time
+from contextlib import contextmanager
+
+
+class MetricsCollector:
+    """
+    Recolecta métricas de `ThermalImageProcessor.process`: duración de cada etapa, tamaño de la imagen,
+    número de zonas, búsquedas en la paleta y tamaño de los arrays principales. Cada llamada a `process`
+    genera un registro (dict) nuevo en `records`.
+    """
+
+    def __init__(self):
+        self.records = []
+        self.current = None
+
+    def start(self, **info):
+        """Inicia el registro de una imagen con la información indicada."""
+
+        self.current = {**info, 'stages': {}, 'arrays': {}, 'peak_array_bytes': 0}
+        self.records.append(self.current)
+        return self.current
+
+    @contextmanager
+    def stage(self, name):
+        """Mide la duración (en segundos) del bloque como la etapa `name`, acumulándola si se repite."""
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stages = self.current['stages']
+            stages[name] = stages.get(name, 0) + time.perf_counter() - start
+
+    def record(self, key, value):
+        """Guarda un valor en el registro actual."""
+
+        self.current[key] = value
+
+    def increment(self, key, value=1):
+        """Suma `value` a un contador del registro actual."""
+
+        self.current[key] = self.current.get(key, 0) + value
+
+    def record_array(self, name, array):
+        """
+        Registra el tamaño en bytes de un array y actualiza el mayor visto en la imagen. Si un mismo nombre se
+        registra varias veces (por ejemplo una vez por mosaico) se conserva el mayor.
+        """
+
+        nbytes = int(array.nbytes)
+        arrays = self.current['arrays']
+        arrays[name] = max(arrays.get(name, 0), nbytes)
+        self.current['peak_array_bytes'] = max(self.current['peak_array_bytes'], nbytes)
+
+    def to_jsonl(self, file):
+        """
+        Escribe los registros como JSON lines, uno por imagen.
+
+        :param file: ruta (se agrega al final del archivo) o flujo de texto con `write`
+        """
+
+        if isinstance(file, str):
+            with open(file, 'a') as f:
+                return self.to_jsonl(f)
+
+        for record in self.records:
+            file.write(json.dumps(record) + '\n')
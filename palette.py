@@ -0,0 +1,173 @@
+import os
+import mmap
+import hashlib
+import threading
+
+import numpy as np
+
+from settings import PALETTE_CACHE_DIR
+
+COLORBAR_HOT_ENDS = ('top', 'bottom', 'left', 'right')
+# Diferencia media máxima (niveles por canal) entre la barra de una imagen y la paleta guardada sin cámara
+# para seguir usando la guardada; el ruido de la compresión JPEG queda muy por debajo
+COLORBAR_TOLERANCE = 8
+
+# Paletas ya cargadas en este proceso, por firma; el candado evita que varios hilos extraigan y guarden a la
+# vez la paleta de una cámara nueva
+_palettes = {}
+_palettes_lock = threading.Lock()
+
+
+class ColorbarPalette:
+    """
+    Paleta densa de 256 colores (uno por nivel de gris, del más frío al más caliente) leída de la barra de
+    colores de un termograma. Se usa con `ThermalImageProcessor.set_palette` en lugar de `settings.PALETTE`.
+
+    :param colors: np.ndarray (256, 3) int32 con los colores en el orden de canales de la imagen (BGR)
+    :param region: tuple (x, y, ancho, alto) de la barra en la imagen
+    :param signature: identifica la paleta en la caché (ver `load_colorbar_palette`)
+    """
+
+    def __init__(self, colors, region, signature=None):
+        self.colors = np.ascontiguousarray(colors, dtype=np.int32).reshape(256, 3)
+        self.values = np.arange(256, dtype=np.uint8)
+        self.region = tuple(int(v) for v in region)
+        self.signature = signature
+
+    def __repr__(self):
+        return f'ColorbarPalette(region={self.region}, signature={self.signature!r})'
+
+    def mask(self, image):
+        """
+        Devuelve una copia de la imagen con la barra pintada del color más frío, para que no se detecte
+        como zona caliente. Si la imagen es un archivo mapeado en memoria (ver `utils.load_image_file`) la
+        copia se mapea en modo copia en escritura: solo pasan a memoria las páginas que toca la barra, y la
+        imagen se puede seguir procesando por mosaicos sin cargarla entera.
+        """
+
+        x, y, w, h = self.region
+        if isinstance(image, np.memmap) and isinstance(image.base, mmap.mmap):
+            order = 'F' if image.flags.f_contiguous and not image.flags.c_contiguous else 'C'
+            image = np.memmap(image.filename, dtype=image.dtype, mode='c', offset=image.offset, shape=image.shape,
+                              order=order)
+        else:
+            image = np.array(image)
+        image[y:y + h, x:x + w] = self.colors[0]
+        return image
+
+
+def extract_colorbar(image, region, hot_end=None):
+    """
+    Lee la escala de colores de la barra de un termograma y la remuestrea a 256 colores.
+
+    Cada posición a lo largo de la barra toma la mediana a lo ancho de la barra, lo que descarta las marcas
+    y el texto que la cámara dibuja encima.
+
+    :param region: tuple (x, y, ancho, alto); la barra es vertical si es más alta que ancha
+    :param hot_end: extremo caliente de la barra, uno de `COLORBAR_HOT_ENDS`; por defecto 'top' en las
+        barras verticales y 'right' en las horizontales
+    :return: np.ndarray (256, 3) int32, del color más frío al más caliente
+    """
+
+    x, y, w, h = (int(v) for v in region)
+    bar = np.asarray(image[max(y, 0):y + h, max(x, 0):x + w])
+    if bar.shape[0] != h or bar.shape[1] != w or not bar.size:
+        raise ValueError(f'La barra de colores {tuple(region)} no está dentro de la imagen')
+
+    vertical = h > w
+    if hot_end is None:
+        hot_end = 'top' if vertical else 'right'
+    if hot_end not in COLORBAR_HOT_ENDS or (hot_end in ('top', 'bottom')) != vertical:
+        orientation = 'vertical' if vertical else 'horizontal'
+        raise ValueError(f"Extremo caliente '{hot_end}' no válido para una barra {orientation}")
+
+    strip = np.median(bar, axis=1 if vertical else 0)
+    if hot_end in ('top', 'left'):
+        strip = strip[::-1]
+
+    positions = np.linspace(0, len(strip) - 1, 256)
+    colors = [np.interp(positions, np.arange(len(strip)), strip[:, channel]) for channel in range(3)]
+    return np.rint(np.stack(colors, axis=1)).astype(np.int32)
+
+
+def load_colorbar_palette(image, region, hot_end=None, camera=None, cache_dir=PALETTE_CACHE_DIR):
+    """
+    Devuelve la paleta de la barra de colores de la imagen. La paleta se guarda en caché con la firma de la
+    cámara y la barra, de modo que las imágenes siguientes usan exactamente la misma paleta (y la misma tabla
+    de búsqueda de `lut.load_lut`) aunque la compresión altere un poco los colores de la barra en cada una.
+
+    Con `camera` la paleta se extrae solo la primera vez. Sin `camera` la firma es la de la barra y la barra
+    de cada imagen se compara con la paleta guardada: si difiere en más de `COLORBAR_TOLERANCE` (otra cámara
+    u otra escala con la barra en el mismo sitio) la paleta se vuelve a extraer y sustituye a la guardada.
+
+    :return: `ColorbarPalette`
+    """
+
+    region = tuple(int(v) for v in region)
+    signature = hashlib.sha256(repr((camera, region, hot_end)).encode()).hexdigest()[:16]
+    # Sin cámara no se sabe si la paleta guardada es la de esta imagen, así que se lee su barra
+    colors = extract_colorbar(image, region, hot_end) if camera is None else None
+
+    palette = _palettes.get(signature)
+    if palette is not None and _same_colorbar(palette.colors, colors):
+        return palette
+
+    with _palettes_lock:
+        # Otro hilo pudo cargarla mientras se esperaba el candado
+        palette = _palettes.get(signature)
+        if palette is not None and _same_colorbar(palette.colors, colors):
+            return palette
+
+        path = os.path.join(cache_dir, f'palette_{signature}.npy')
+        try:
+            cached = np.load(path)
+        except (OSError, ValueError):
+            cached = None
+
+        if cached is not None and _same_colorbar(cached, colors):
+            colors = cached
+        else:
+            if colors is None:
+                colors = extract_colorbar(image, region, hot_end)
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, colors)
+            os.replace(tmp_path, path)
+
+        palette = _palettes[signature] = ColorbarPalette(colors, region, signature)
+        return palette
+
+
+def _same_colorbar(cached, colors):
+    """Indica si la barra leída `colors` (None si no se ha leído) coincide con la paleta guardada `cached`."""
+
+    return colors is None or np.abs(np.asarray(cached, dtype=np.int32) - colors).mean() <= COLORBAR_TOLERANCE
+
+
+def parse_region(value):
+    """Convierte `x, y, ancho, alto` (de la línea de comandos o de un .ini) en una tupla de enteros."""
+
+    region = tuple(int(v) for v in value.replace(',', ' ').split())
+    if len(region) != 4:
+        raise ValueError(f'Región no válida: {value!r}; se esperaba x, y, ancho, alto')
+    return region
+
+
+def calibrate_palette(thermal_processor, image, config, colorbar=None):
+    """
+    Aplica al procesador la paleta de la barra de colores de la imagen, indicada en la línea de comandos
+    (`colorbar`: dict con 'region', 'hot_end' y 'camera') o en la sección [palette] del archivo de
+    configuración. Sin barra de colores el procesador vuelve a la paleta de `settings.PALETTE`.
+
+    :return: `palette.ColorbarPalette`, o None si no hay barra de colores
+    """
+
+    colorbar = colorbar or config['palette']
+    if colorbar is None:
+        thermal_processor.set_palette(*thermal_processor.default_palette)
+        return None
+
+    palette = load_colorbar_palette(image, colorbar['region'], colorbar['hot_end'], colorbar['camera'])
+    thermal_processor.set_palette(palette.colors, palette.values)
+    return palette
@@ -14,3 +14,47 @@ class PDF(FPDF):
         self.set_y(-15)
         self.set_font('helvetica', 'I', 8)
         self.cell(0, 10, f'Página {self.page_no()}', 0, 0, 'C')
+
+    def bar_chart(self, counts, edges, title, xlabel, ylabel, w=190, h=110):
+        """
+        Dibuja un diagrama de barras directamente en el PDF a partir de un histograma (frecuencias y bordes).
+        """
+
+        x0, y0 = self.get_x(), self.get_y()
+        self.set_font('helvetica', 'B', 12)
+        self.cell(w, 8, title, 0, 1, 'C')
+
+        # Área del gráfico, dejando espacio para las etiquetas de los ejes
+        left, bottom = x0 + 20, y0 + h - 15
+        plot_w, plot_h = w - 25, h - 30
+        max_count = max(max(counts), 1)
+        bar_w = plot_w / len(counts)
+
+        self.set_fill_color(70, 110, 220)
+        for i, count in enumerate(counts):
+            bar_h = count / max_count * plot_h
+            if bar_h > 0:
+                self.rect(left + i * bar_w, bottom - bar_h, bar_w, bar_h, 'F')
+
+        self.line(left, bottom, left + plot_w, bottom)
+        self.line(left, bottom, left, bottom - plot_h)
+
+        # Marcas de los ejes
+        self.set_font('helvetica', '', 7)
+        for fraction in (0, 0.25, 0.5, 0.75, 1):
+            y = bottom - fraction * plot_h
+            self.line(left - 1, y, left, y)
+            label = f'{fraction * max_count:.0f}'
+            self.text(left - 2 - self.get_string_width(label), y + 1, label)
+        step = max(len(counts) // 5, 1)
+        for i in range(0, len(edges), step):
+            x = left + i * bar_w
+            self.line(x, bottom, x, bottom + 1)
+            self.text(x - 4, bottom + 5, f'{edges[i]:.1f}')
+
+        self.set_font('helvetica', '', 9)
+        self.text(left + plot_w / 2 - self.get_string_width(xlabel) / 2, bottom + 11, xlabel)
+        with self.rotation(90, x0 + 4, bottom - plot_h / 2):
+            self.text(x0 + 4 - self.get_string_width(ylabel) / 2, bottom - plot_h / 2, ylabel)
+
+        self.set_xy(x0, y0 + h)
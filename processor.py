@@ -1,145 +1,750 @@
-from io import BytesIO
+import os
+import tempfile
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 
 import cv2
-import matplotlib.pyplot as plt
 import numpy as np
 
-from settings import PALETTE
-from utils import interpolate_palette, nearest_color, celsius_to_kelvin
+from filters import DenoiseFilter
+from lut import load_lut, apply_lut, palette_hash, ERROR_KEYS
+from settings import PALETTE, CO
+from tiling import iter_tiles, padded_window, TileComponentMerger
+from zones import HeatZone, contour_children, pack_zone_geometry, unpack_zone_geometry
+from utils import interpolate_palette, palette_to_arrays, nearest_color_map, grey_level_counts, celsius_to_kelvin
+
+
+ZONE_ENGINES = ('contours', 'components')
+SEGMENTATIONS = ('threshold', 'region_growing')
+
+# Margen de los mosaicos para que la apertura (elipse 5x5, erosión más dilatación) dé el mismo resultado que
+# sobre la imagen completa; el del filtro de ruido lo indica cada filtro (`DenoiseFilter.halo`)
+MASK_HALO = 4
+
+# Contexto vacío compartido para las etapas cuando no hay recolector de métricas
+_NO_STAGE = nullcontext()
+
+# Zonas mínimas por bloque al repartir la medición de zonas entre hilos
+ZONE_CHUNK_SIZE = 64
+
+
+class ProcessResult(tuple):
+    """
+    Resultado de `ThermalImageProcessor.process`. Se desempaqueta como `(zonas, histograma)` y, si el
+    procesador tiene un recolector de métricas, expone el registro de la imagen en `metrics`.
+    """
+
+    def __new__(cls, zones, histogram, metrics=None):
+        result = super().__new__(cls, (zones, histogram))
+        result.metrics = metrics
+        return result
+
+    @property
+    def zones(self):
+        return self[0]
+
+    @property
+    def histogram(self):
+        return self[1]
 
 
 class ThermalImageProcessor:
-    def __init__(self):
-        self.palette = interpolate_palette(PALETTE)
+    def __init__(self, lut_bits=None, zone_engine='contours', collector=None, cache=None, denoise=None,
+                 segmentation='threshold', region_tolerance=10, min_zone_area=0.0, top_zones=None, zone_workers=1):
+        """
+        :param lut_bits: None para calcular el color más cercano en cada imagen, 8 para usar una tabla de
+            búsqueda exacta en caché o menos de 8 para una tabla cuantizada (ver `lut_error`).
+        :param zone_engine: 'contours' mide cada zona a partir de sus contornos; 'components' mide todas las
+            zonas en una sola pasada sobre las componentes conexas de la máscara.
+        :param collector: `metrics.MetricsCollector` opcional para registrar métricas de cada `process`.
+        :param cache: `cache.ResultCache` opcional donde `process` guarda y reutiliza el mapa en escala de
+            grises y la geometría de las zonas.
+        :param denoise: filtro de ruido por defecto, como nombre de `filters.DENOISE_FILTERS` o
+            `filters.DenoiseFilter`; si no se indica se usa el filtro bilateral original.
+        :param segmentation: 'threshold' toma como zonas los píxeles por encima de `threshold_hot`;
+            'region_growing' hace crecer regiones desde los máximos locales por encima de `threshold_hot`
+            (ver `calculate_zone_mask`).
+        :param region_tolerance: diferencia de gris máxima (exclusiva) con la semilla en 'region_growing'.
+        :param min_zone_area: área mínima (m²) de una zona; las menores se descartan antes de medirlas.
+        :param top_zones: si se indica, solo se conservan las `top_zones` zonas de mayor pérdida de calor,
+            ordenadas de mayor a menor pérdida (ver `select_zones`).
+        :param zone_workers: hilos con los que se miden las zonas de una imagen y se codifican sus miniaturas
+            (ver `map_zone_chunks`); 1 lo hace todo en el hilo que llama.
+        """
+
+        if zone_engine not in ZONE_ENGINES:
+            raise ValueError(f'Motor de zonas desconocido: {zone_engine}')
+        if segmentation not in SEGMENTATIONS:
+            raise ValueError(f'Segmentación desconocida: {segmentation}')
+        if region_tolerance < 1:
+            raise ValueError(f'La tolerancia de las regiones debe ser al menos 1, se recibió {region_tolerance}')
+        self.zone_engine = zone_engine
+        self.segmentation = segmentation
+        self.region_tolerance = region_tolerance
+        self.min_zone_area = min_zone_area
+        self.top_zones = top_zones
+        self.zone_workers = max(int(zone_workers or 1), 1)
+        self._zone_executor = None
+        self.collector = collector
+        self.cache = cache
+        self.denoise = DenoiseFilter(denoise) if isinstance(denoise, str) else denoise or DenoiseFilter()
+
+        self.lut_bits = lut_bits
+        self.palette_colors = self.palette_values = None
+        self.default_palette = palette_to_arrays(interpolate_palette(PALETTE))
+        self.set_palette(*self.default_palette)
+
+    def set_palette(self, colors, values):
+        """
+        Cambia la paleta con la que se convierten las imágenes a escala de grises, por ejemplo por la de
+        `palette.ColorbarPalette`. Si la paleta no cambia no se hace nada; si cambia y el procesador usa tabla
+        de búsqueda se carga la de la nueva paleta (ver `lut.load_lut`).
+
+        :param colors: np.ndarray (N, 3) con los colores de la paleta
+        :param values: np.ndarray (N,) con los valores en escala de grises
+        """
+
+        colors = np.asarray(colors, dtype=np.int32)
+        values = np.asarray(values, dtype=np.uint8)
+        if (self.palette_colors is not None and np.array_equal(colors, self.palette_colors)
+                and np.array_equal(values, self.palette_values)):
+            return
+
+        self.palette_colors, self.palette_values = colors, values
+        self.lut = None
+        self.lut_error = dict.fromkeys(ERROR_KEYS, 0)
+        if self.lut_bits is not None:
+            self.lut, self.lut_error = load_lut(colors, values, self.lut_bits)
+        self.lut_max_error = self.lut_error['max_error']
+
+    def denoise_filter(self, denoise=None):
+        """
+        Devuelve el `DenoiseFilter` indicado por nombre o como objeto, o el del procesador si es None.
+        """
+
+        if denoise is None:
+            return self.denoise
+        if isinstance(denoise, str):
+            return DenoiseFilter(denoise)
+        return denoise
 
     def apply_bilateral_filter(self, image):
         """
-        Aplica un filtro bilateral a la imagen para mejorarla.
+        Aplica un filtro bilateral a la imagen para mejorarla. Equivale a `apply_denoise_filter(image, 'bilateral')`.
+        """
+
+        return self.apply_denoise_filter(image, 'bilateral')
+
+    def apply_denoise_filter(self, image, denoise=None):
+        """
+        Aplica el filtro de reducción de ruido a la imagen para mejorarla.
+
+        :param denoise: filtro para esta imagen (ver `denoise_filter`); por defecto el del procesador
         """
 
-        return cv2.bilateralFilter(image, 9, 75, 75)
+        return self.denoise_filter(denoise)(image)
 
     def calculate_grayscale_map(self, image):
         """
         Calcula el mapa en escala de grises a partir de una imagen RGB.
         """
 
-        height, width, _ = image.shape
-        grayscale_map = np.zeros((height, width), dtype=np.uint8)
-        for i in range(height):
-            for j in range(width):
-                grayscale_map[i, j] = nearest_color(image[i, j], self.palette)
+        if self.lut is not None:
+            if self.collector is not None:
+                self.collector.increment('palette_lookups', image.shape[0] * image.shape[1])
+            return apply_lut(image, self.lut)
+
+        stats = {} if self.collector is not None else None
+        grayscale_map = nearest_color_map(image, self.palette_colors, self.palette_values, stats=stats)
+        if stats is not None:
+            self.collector.increment('palette_lookups', stats['palette_lookups'])
         return grayscale_map
 
+    def calculate_temperature_lut(self, min_temp, max_temp, dtype=np.float32):
+        """
+        Calcula la temperatura de cada uno de los 256 niveles de gris.
+
+        Es la representación compacta del mapa de temperaturas: el mapa en escala de grises más esta tabla.
+        Las etapas que solo necesitan promedios o histogramas trabajan con conteos de niveles de gris y esta
+        tabla, sin llegar a crear el mapa de temperaturas.
+        """
+
+        return (np.arange(256) / 255 * (max_temp - min_temp) + min_temp).astype(dtype)
+
     def calculate_temperature_map(self, grayscale_map, max_temp, min_temp):
         """
-        Calcula el mapa de temperaturas de una imagen térmica.
+        Calcula el mapa de temperaturas (float32) de una imagen térmica, solo para quien lo necesite completo;
+        `process` no lo crea (ver `calculate_temperature_lut`) y `iter_temperature_map` lo recorre por bandas.
+
+        Se indexa la tabla de `calculate_temperature_lut` con el mapa en escala de grises, por lo que se crea
+        un único array de 4 bytes por píxel en lugar de varios temporales de 8 bytes por píxel.
         """
 
-        temperature_map = grayscale_map / 255 * (max_temp - min_temp) + min_temp
-        return temperature_map
+        return self.calculate_temperature_lut(min_temp, max_temp)[grayscale_map]
 
-    def find_hot_zones(self, grayscale_map, threshold_hot=200):
+    def iter_temperature_map(self, grayscale_map, max_temp, min_temp, tile_pixels=1 << 20):
         """
-        Busca zonas calientes en el mapa en escala de grises.
+        Recorre el mapa de temperaturas (float32) por bandas de filas de como máximo `tile_pixels` píxeles, para
+        quien necesite la temperatura de cada píxel de una imagen grande sin crear el mapa completo. Todas las
+        bandas se escriben en el mismo array, así que hay que copiar una banda para conservarla.
+
+        :return: generador de tuple (fila inicial, np.ndarray (filas, ancho) float32)
+        """
+
+        temperature_lut = self.calculate_temperature_lut(min_temp, max_temp)
+        height, width = grayscale_map.shape[:2]
+        tile_rows = max(1, tile_pixels // max(width, 1))
+        buffer = np.empty((min(tile_rows, height), width), dtype=np.float32)
+
+        for top in range(0, height, tile_rows):
+            band = grayscale_map[top:top + tile_rows]
+            yield top, np.take(temperature_lut, band, out=buffer[:len(band)])
+
+    def calculate_hot_mask(self, grayscale_map, threshold_hot=200):
+        """
+        Calcula la máscara binaria de las zonas calientes.
         """
 
         mask = cv2.threshold(grayscale_map, threshold_hot, 255, cv2.THRESH_BINARY)[1]
         kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-        contours, hierarchy = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        return contours, hierarchy
+        return cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
 
-    def calculate_histogram(self, temperature_map, min_temp, max_temp):
+    def find_seeds(self, grayscale_map, threshold_hot=200, min_distance=5):
         """
-        Calcula y guarda el histograma del mapa de temperaturas.
+        Busca semillas para el crecimiento de regiones: los máximos locales del mapa en escala de grises (en
+        una ventana de `2 * min_distance + 1` píxeles) con valor mayor o igual que `threshold_hot`.
+
+        :return: np.ndarray (N, 2) con las coordenadas (fila, columna) de las semillas
         """
 
-        # Crear el histograma
-        fig, ax = plt.subplots()
-        ax.hist(temperature_map.ravel(), bins=50, range=(min_temp, max_temp),
-                color='blue', alpha=0.7)
-        ax.set_title('Histograma de la Imagen Térmica')
-        ax.set_xlabel('Valor de temperatura (K)')
-        ax.set_ylabel('Frecuencia')
+        kernel = np.ones((2 * min_distance + 1, 2 * min_distance + 1), np.uint8)
+        peaks = (cv2.dilate(grayscale_map, kernel) == grayscale_map) & (grayscale_map >= threshold_hot)
+        return np.argwhere(peaks)
+
+    def grow_regions(self, grayscale_map, seeds, tolerance=10):
+        """
+        Hace crecer una región desde cada semilla: los píxeles conectados (conectividad 8) a la semilla a través
+        de píxeles cuyo gris difiere del de la semilla en menos de `tolerance`.
 
-        # Guardar la imagen en un objeto BytesIO en lugar de en el disco
-        buf = BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
+        Es el mismo criterio que el prototipo `debug_region_growing.region_growing`, pero en lugar de recorrer
+        los vecinos uno a uno en Python cada región se rellena con `cv2.floodFill` en modo de rango fijo. Las
+        semillas se agrupan por valor de gris: las de un mismo valor comparten una máscara, y las que ya quedaron
+        dentro de la región de otra semilla con su mismo valor no se vuelven a rellenar, así que el costo depende
+        del número de regiones distintas y no del de semillas.
 
-        # Obtener los bytes de la imagen
-        image_bytes = buf.getvalue()
+        :param seeds: coordenadas (fila, columna) de las semillas, por ejemplo de `find_seeds`
+        :return: máscara uint8 (255 = región) con la unión de todas las regiones
+        """
 
-        # Convertir los bytes en un array de NumPy
-        nparr = np.frombuffer(image_bytes, np.uint8)
+        height, width = grayscale_map.shape
+        mask = np.zeros((height, width), np.uint8)
+        seeds = np.asarray(seeds, dtype=np.intp).reshape(-1, 2)
+        values = grayscale_map[seeds[:, 0], seeds[:, 1]]
+        flags = 8 | cv2.FLOODFILL_MASK_ONLY | cv2.FLOODFILL_FIXED_RANGE | (255 << 8)
 
-        # Decodificar la imagen usando OpenCV
-        image_cv2 = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        for value in np.unique(values):
+            # Cada valor usa su propia máscara: floodFill no atraviesa píxeles ya marcados en ella
+            region = np.zeros((height + 2, width + 2), np.uint8)
+            for y, x in seeds[values == value].tolist():
+                if not region[y + 1, x + 1]:
+                    cv2.floodFill(grayscale_map, region, (x, y), 0, tolerance - 1, tolerance - 1, flags)
+            cv2.bitwise_or(mask, region[1:-1, 1:-1], mask)
 
-        # Cerrar el buffer y la figura
-        buf.close()
-        plt.close(fig)
+        return mask
 
-        return image_cv2
+    def calculate_zone_mask(self, grayscale_map, threshold_hot=200):
+        """
+        Calcula la máscara de zonas calientes con la segmentación del procesador: `calculate_hot_mask` o el
+        crecimiento de regiones desde los máximos locales por encima de `threshold_hot`.
+        """
+
+        if self.segmentation == 'region_growing':
+            return self.grow_regions(grayscale_map, self.find_seeds(grayscale_map, threshold_hot),
+                                     self.region_tolerance)
+        return self.calculate_hot_mask(grayscale_map, threshold_hot)
+
+    def find_hot_zones(self, grayscale_map, threshold_hot=200):
+        """
+        Busca zonas calientes en el mapa en escala de grises.
+        """
+
+        mask = self.calculate_zone_mask(grayscale_map, threshold_hot)
+        contours, hierarchy = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        return contours, hierarchy
+
+    def calculate_histogram(self, grayscale_map, min_temp, max_temp, bins=50):
+        """
+        Calcula el histograma del mapa de temperaturas a partir del mapa en escala de grises.
+
+        Como la conversión gris -> temperatura es lineal, basta contar los 256 niveles de gris y repartirlos
+        en los intervalos de temperatura. El resultado coincide con `np.histogram` sobre el mapa de
+        temperaturas sin llegar a calcularlo. Para dibujarlo ver `utils.render_histogram` o `PDF.bar_chart`.
+
+        :return: tuple (frecuencias, bordes de los intervalos) como `np.histogram`
+        """
+
+        grey_counts = grey_level_counts(grayscale_map)
+        grey_temps = self.calculate_temperature_lut(min_temp, max_temp, np.float64)
+        counts, edges = np.histogram(grey_temps, bins=bins, range=(min_temp, max_temp), weights=grey_counts)
+        return counts.astype(np.int64), edges
 
     def calculate_heat_loss(self, image, grayscale, contours, hierarchy, b, ac, taf, co, d, bw, min_temp, max_temp):
         """
         Calcula la pérdida de calor en cada zona caliente.
+
+        Los huecos de cada zona salen de un índice padre → hijos construido una sola vez a partir de
+        `hierarchy`, y las zonas cuyo contorno exterior no alcanza `min_zone_area` se descartan antes de
+        medirlas. La máscara de cada zona se dibuja solo sobre su rectángulo envolvente.
         """
 
         px_per_meter = bw / d
+        min_area_px = self.min_zone_area * px_per_meter ** 2
+        grey_temps = self.calculate_temperature_lut(min_temp, max_temp, np.float64)
+        children = contour_children(hierarchy)
 
-        data = []
-        # original_image = self.image.copy()
-        for idx, contour in enumerate(contours):
+        def measure(indices):
+            data = []
+            for idx in indices:
+                contour = contours[idx]
 
-            # Verificar si el contorno NO es un hueco
-            if hierarchy[0][idx][3] != -1:
-                continue
+                # El área sin huecos nunca supera la del contorno exterior
+                area_px = cv2.contourArea(contour)
+                if area_px < min_area_px:
+                    continue
 
-            temp_image = image.copy()
-            cv2.drawContours(temp_image, [contour], 0, (0, 0, 0), 2)
-            # cv2.drawContours(original_image, [contour], 0, (0, 0, 0), 2)
-            mask = np.zeros(grayscale.shape, np.uint8)
-            cv2.drawContours(mask, [contour], 0, 255, -1)
+                holes = [contours[edx] for edx in children[idx]]
+                area_px -= sum(cv2.contourArea(hole) for hole in holes)
+                if area_px < min_area_px:
+                    continue
 
-            zone = grayscale[mask == 255]
-            area_px = cv2.contourArea(contour)
+                # Histograma de niveles de gris de la zona
+                x, y, w, h = cv2.boundingRect(contour)
+                mask = np.zeros((h, w), np.uint8)
+                cv2.drawContours(mask, [contour], 0, 255, -1, offset=(-x, -y))
+                zone_counts = cv2.calcHist([grayscale[y:y + h, x:x + w]], [0], mask, [256], [0, 256]).ravel()
 
-            # Comprobar si existen huecos en el contorno
-            for edx, contour2 in enumerate(contours):
-                if hierarchy[0][edx][3] == idx:
-                    cv2.drawContours(temp_image, [contour2], 0, (0, 0, 0), 2)
-                    # cv2.drawContours(original_image, [contour2], 0, (0, 0, 0), 2)
-                    area_px -= cv2.contourArea(contour2)
+                # Convertir a metros el área de la zona caliente
+                area = area_px / px_per_meter ** 2
 
-            # Convertir a metros el área de la zona caliente
-            area = area_px / px_per_meter ** 2
+                # Calcular temperatura promedio de la zona caliente
+                mean_temp_zone = zone_counts @ grey_temps / zone_counts.sum()
 
-            # Calcular temperatura promedio de la zona caliente
-            mean_temp_zone = np.mean(
-                zone / 255 * (max_temp - min_temp) + min_temp)
+                # Calcular pérdida de calor de la zona caliente
+                heat_loss = self.calculate_zone_heat_loss(area, mean_temp_zone, b, ac, taf, co)
 
-            # Calcular pérdida de calor de la zona caliente
-            heat_loss = (area / b) * (ac * (celsius_to_kelvin(mean_temp_zone) - taf) + co * (
-                    ((celsius_to_kelvin(mean_temp_zone) / 100) ** 4) - ((taf / 100) ** 4)))
+                data.append(HeatZone(image, contour, holes, area, mean_temp_zone, heat_loss, bbox=(x, y, w, h)))
+            return data
 
-            data.append((temp_image, area, mean_temp_zone, heat_loss))
+        # Solo los contornos exteriores son zonas; los demás son huecos (o islas dentro de un hueco)
+        outer = [] if hierarchy is None else np.flatnonzero(hierarchy[0][:, 3] == -1).tolist()
+        return self.rank_zones(self.map_zone_chunks(measure, outer))
 
-        return data
+    def select_zones(self, areas_px, heat_losses, px_per_meter):
+        """
+        Elige las zonas que se conservan a partir de sus medidas: las de área de al menos `min_zone_area` y,
+        si `top_zones` está indicado, solo las de mayor pérdida de calor, de mayor a menor (los empates
+        conservan el orden original).
+
+        :return: np.ndarray con los índices de las zonas elegidas, en el orden en que se deben entregar
+        """
+
+        keep = np.flatnonzero(np.asarray(areas_px) >= self.min_zone_area * px_per_meter ** 2)
+        if self.top_zones is not None:
+            keep = keep[np.argsort(-np.asarray(heat_losses)[keep], kind='stable')[:self.top_zones]]
+        return keep
+
+    def rank_zones(self, zones):
+        """Con `top_zones`, ordena las zonas por pérdida de calor de mayor a menor y conserva las primeras."""
+
+        if self.top_zones is None:
+            return zones
+        return sorted(zones, key=lambda zone: zone.heat_loss, reverse=True)[:self.top_zones]
+
+    def map_zone_chunks(self, measure, items):
+        """
+        Aplica `measure` (que recibe una lista de elementos y devuelve una lista de zonas) a bloques
+        consecutivos de `items` en `zone_workers` hilos y une los resultados en el orden de `items`, así que
+        el resultado no depende del número de hilos. OpenCV y NumPy liberan el GIL en el trabajo de cada zona.
+        Con un solo hilo, o con pocos elementos, `measure` se llama una vez con todos.
+        """
+
+        items = list(items)
+        if self.zone_workers == 1 or len(items) <= ZONE_CHUNK_SIZE:
+            return measure(items)
+
+        if self._zone_executor is None:
+            self._zone_executor = ThreadPoolExecutor(max_workers=self.zone_workers, thread_name_prefix='zones')
+
+        # Varios bloques por hilo para repartir bien zonas de tamaños muy distintos
+        size = max(ZONE_CHUNK_SIZE, -(-len(items) // (4 * self.zone_workers)))
+        chunks = [items[start:start + size] for start in range(0, len(items), size)]
+        return [zone for zones in self._zone_executor.map(measure, chunks) for zone in zones]
+
+    def close(self):
+        """
+        Detiene los hilos de `map_zone_chunks`, esperando a que terminen los bloques en curso. El procesador
+        se puede seguir usando: los hilos se vuelven a crear si hacen falta. También se usa como contexto
+        (`with ThermalImageProcessor(...) as processor:`).
+        """
+
+        executor, self._zone_executor = self._zone_executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def calculate_heat_loss_components(self, image, grayscale, mask, b, ac, taf, co, d, bw, min_temp, max_temp):
+        """
+        Calcula la pérdida de calor de todas las zonas calientes en una sola pasada.
+
+        Cada componente conexa de la máscara es una zona. El área se cuenta en píxeles, por lo que los huecos
+        quedan excluidos tanto del área como de la temperatura promedio, y las islas dentro de un hueco son
+        zonas independientes. Solo se extraen los contornos de las zonas que elige `select_zones`.
+        """
+
+        num_labels, labels, stats, areas, mean_temps, heat_losses = self.component_statistics(
+            grayscale, mask, b, ac, taf, co, d, bw, min_temp, max_temp)
+
+        height, width = mask.shape
+
+        def measure(selected):
+            data = []
+            for label in selected:
+                x, y, w, h = stats[label, :4]
+                x0, y0 = max(x - 1, 0), max(y - 1, 0)
+                x1, y1 = min(x + w + 1, width), min(y + h + 1, height)
+
+                # Extraer el borde de la zona (y de sus huecos) solo a partir del recorte de las etiquetas
+                zone_mask = (labels[y0:y1, x0:x1] == label).astype(np.uint8)
+                zone_contours, zone_hierarchy = cv2.findContours(zone_mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE,
+                                                                 offset=(int(x0), int(y0)))
+                outer = [c for c, h in zip(zone_contours, zone_hierarchy[0]) if h[3] == -1]
+                holes = [c for c, h in zip(zone_contours, zone_hierarchy[0]) if h[3] != -1]
+
+                data.append(HeatZone(image, outer[0], holes, areas[label - 1], mean_temps[label - 1],
+                                     heat_losses[label - 1], bbox=(x, y, w, h)))
+            return data
+
+        return self.map_zone_chunks(measure, self.select_zones(stats[1:, cv2.CC_STAT_AREA], heat_losses, bw / d) + 1)
+
+    def component_statistics(self, grayscale, mask, b, ac, taf, co, d, bw, min_temp, max_temp):
+        """
+        Calcula el área, la temperatura promedio y la pérdida de calor de cada componente conexa de la máscara
+        sin extraer sus contornos.
+
+        :return: tuple (número de etiquetas, etiquetas, estadísticas de `cv2.connectedComponentsWithStats`,
+            áreas, temperaturas promedio, pérdidas de calor), estas tres últimas sin el fondo
+        """
+
+        px_per_meter = bw / d
+
+        num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        areas_px = stats[1:, cv2.CC_STAT_AREA]
+        grey_sums = np.bincount(labels.ravel(), weights=grayscale.ravel(), minlength=num_labels)[1:]
+
+        areas = areas_px / px_per_meter ** 2
+        mean_temps = grey_sums / areas_px / 255 * (max_temp - min_temp) + min_temp
+        heat_losses = self.calculate_zone_heat_loss(areas, mean_temps, b, ac, taf, co)
+        return num_labels, labels, stats, areas, mean_temps, heat_losses
 
-    def process(self, image, b, ac, taf, co, d, bw, min_temp, max_temp, threshold_hot=200):
+    @staticmethod
+    def calculate_zone_heat_loss(area, mean_temp, b, ac, taf, co):
+        """
+        Calcula la pérdida de calor de una zona (o, elemento a elemento, de arrays de zonas).
+        """
+
+        temp = celsius_to_kelvin(mean_temp)
+        temp_2 = (temp / 100) ** 2
+        taf_2 = (taf / 100) ** 2
+        return (area / b) * (ac * (temp - taf) + co * (temp_2 * temp_2 - taf_2 * taf_2))
+
+    @staticmethod
+    def calculate_heat_loss_matrix(areas, mean_temps, b, ac, taf, co=CO):
+        """
+        Evalúa la pérdida de calor de muchas zonas en muchos escenarios con una sola operación de NumPy.
+
+        Los parámetros `b`, `ac`, `taf` y `co` pueden ser escalares o arrays y se combinan entre sí con las
+        reglas de broadcasting: arrays de la misma longitud describen escenarios completos (uno por posición),
+        mientras que, por ejemplo, `b[:, None, None]`, `ac[None, :, None]` y `taf[None, None, :]` recorren la
+        rejilla de todas sus combinaciones.
+
+        :param areas: áreas de las zonas en m²
+        :param mean_temps: temperaturas promedio de las zonas
+        :return: np.ndarray de forma (zonas,) + forma de los parámetros combinados
+        """
+
+        b, ac, taf, co = np.broadcast_arrays(*(np.asarray(value, np.float64) for value in (b, ac, taf, co)))
+        areas = np.asarray(areas, np.float64).ravel()
+        temps = celsius_to_kelvin(np.asarray(mean_temps, np.float64).ravel())
+
+        # area / b * (ac * (T - taf) + co * (T⁴ - taf⁴)) se separa en términos por zona (area * T, area * T⁴,
+        # area) y por escenario, de modo que la matriz completa es un único producto de matrices
+        temps_2 = (temps / 100) ** 2
+        taf_2 = (taf / 100) ** 2
+        zone_terms = np.stack([areas * temps, areas * temps_2 * temps_2, -areas], axis=1)
+        scenario_terms = np.stack([ac / b, co / b, (ac * taf + co * taf_2 * taf_2) / b]).reshape(3, -1)
+        return (zone_terms @ scenario_terms).reshape(areas.shape + b.shape)
+
+    def heat_loss_scenarios(self, zones, b, ac, taf, co=CO):
+        """
+        Matriz zonas × escenarios de la pérdida de calor de las zonas de un resultado de `process` (ver
+        `calculate_heat_loss_matrix`), sin volver a procesar la imagen.
+        """
+
+        areas = np.fromiter((zone.area for zone in zones), np.float64)
+        mean_temps = np.fromiter((zone.mean_temp for zone in zones), np.float64)
+        return self.calculate_heat_loss_matrix(areas, mean_temps, b, ac, taf, co)
+
+    def process(self, image, b, ac, taf, co, d, bw, min_temp, max_temp, threshold_hot=200, denoise=None):
         """
         Realizar el procesamiento completo de la imagen térmica
+
+        :param denoise: filtro de ruido para esta imagen (ver `denoise_filter`); por defecto el del procesador
+        :return: `ProcessResult` que se desempaqueta como `(zonas, histograma)`
+        """
+
+        denoise = self.denoise_filter(denoise)
+        collector = self.collector
+        metrics = None
+        if collector is not None:
+            metrics = collector.start(height=image.shape[0], width=image.shape[1], zone_engine=self.zone_engine,
+                                      threshold_hot=threshold_hot, denoise=denoise.name)
+        cache = self.cache
+        cached = geometry = None
+        if cache is not None:
+            image_key = cache.make_key('grayscale', image, palette_hash(self.palette_colors, self.palette_values),
+                                       self.lut_bits, denoise.signature)
+            # El filtro de área depende de la escala y el ranking de las constantes físicas; sin ellos la misma
+            # geometría sirve para cualquier escala y constantes
+            zones_key = cache.make_key('zones', image_key, self.zone_engine, self.segmentation, self.region_tolerance,
+                                       threshold_hot, min_temp, max_temp,
+                                       self.min_zone_area and self.min_zone_area * (bw / d) ** 2,
+                                       self.top_zones and (self.top_zones, b, ac, taf, co))
+            cached = cache.load(image_key)
+
+        if cached is not None:
+            filtered_image, grayscale_map = cached['filtered_image'], cached['grayscale_map']
+        else:
+            with self.measure_stage('apply_denoise_filter'):
+                filtered_image = self.apply_denoise_filter(image, denoise)
+            with self.measure_stage('calculate_grayscale_map'):
+                grayscale_map = self.calculate_grayscale_map(filtered_image)
+            if cache is not None:
+                cache.store(image_key, filtered_image=filtered_image, grayscale_map=grayscale_map)
+
+        with self.measure_stage('calculate_histogram'):
+            histogram = self.calculate_histogram(grayscale_map, min_temp, max_temp)
+
+        if cache is not None:
+            geometry = cache.load(zones_key)
+
+        if geometry is not None:
+            # Solo se vuelve a aplicar la fórmula con las constantes físicas actuales
+            with self.measure_stage('calculate_heat_loss'):
+                areas = geometry['area_px'] / (bw / d) ** 2
+                heat_losses = self.calculate_zone_heat_loss(areas, geometry['mean_temp'], b, ac, taf, co)
+                data = [HeatZone(image, contour, holes, area, mean_temp, heat_loss, bbox=bbox)
+                        for (contour, holes, bbox, _, mean_temp), area, heat_loss
+                        in zip(unpack_zone_geometry(geometry), areas, heat_losses)]
+        elif self.zone_engine == 'components':
+            with self.measure_stage('find_hot_zones'):
+                mask = self.calculate_zone_mask(grayscale_map, threshold_hot)
+            with self.measure_stage('calculate_heat_loss'):
+                data = self.calculate_heat_loss_components(image, grayscale_map, mask, b, ac, taf, co, d, bw,
+                                                           min_temp, max_temp)
+        else:
+            with self.measure_stage('find_hot_zones'):
+                contours, hierarchy = self.find_hot_zones(grayscale_map, threshold_hot)
+            with self.measure_stage('calculate_heat_loss'):
+                data = self.calculate_heat_loss(image, grayscale_map, contours, hierarchy, b, ac, taf, co, d, bw,
+                                                min_temp, max_temp)
+
+        if cache is not None and geometry is None:
+            cache.store(zones_key, **pack_zone_geometry(data, bw / d))
+
+        if collector is not None:
+            collector.record('zones', len(data))
+            collector.record('cache_hits', (cached is not None) + (geometry is not None))
+            collector.record_array('filtered_image', filtered_image)
+            collector.record_array('grayscale_map', grayscale_map)
+
+        return ProcessResult(data, histogram, metrics)
+
+    def sweep_thresholds(self, image, b, ac, taf, co, d, bw, min_temp, max_temp, thresholds, denoise=None):
+        """
+        Evalúa varios umbrales de zonas calientes sobre una misma imagen, para elegir `threshold_hot`.
+
+        El filtro y el mapa en escala de grises se calculan una sola vez. La apertura en escala de grises con
+        el mismo elemento estructurante conmuta con la umbralización, así que también se calcula una sola vez
+        y la máscara de cada umbral es `apertura > umbral`, idéntica a `calculate_hot_mask`. Como las máscaras
+        de umbrales mayores están contenidas en las de umbrales menores, todas se evalúan sobre el recorte que
+        ocupa la del umbral más bajo, y los umbrales sin píxeles calientes (según el histograma acumulado de
+        la apertura) se resuelven sin buscar zonas.
+
+        Con el motor 'components' solo se calculan las estadísticas de las zonas; con 'contours' las zonas se
+        miden igual que en `process`. Con la segmentación 'region_growing' el umbral elige las semillas y la
+        máscara de cada umbral se calcula completa con `calculate_zone_mask`.
+
+        :param thresholds: iterable de umbrales (0-255)
+        :param denoise: filtro de ruido para esta imagen; por defecto el del procesador
+        :return: lista de dict con 'threshold', 'zones', 'total_area' y 'total_heat_loss', uno por umbral
         """
 
-        filtered_image = self.apply_bilateral_filter(image)
+        filtered_image = self.apply_denoise_filter(image, denoise)
         grayscale_map = self.calculate_grayscale_map(filtered_image)
-        contours, hierarchy = self.find_hot_zones(grayscale_map, threshold_hot)
+        thresholds = [int(t) for t in thresholds]
+
+        rows = []
+        for threshold, mask, (x0, y0) in self._sweep_masks(grayscale_map, thresholds):
+            row = {'threshold': threshold, 'zones': 0, 'total_area': 0.0, 'total_heat_loss': 0.0}
+            if mask is not None:
+                if self.zone_engine == 'components':
+                    height, width = mask.shape
+                    grayscale_crop = np.ascontiguousarray(grayscale_map[y0:y0 + height, x0:x0 + width])
+                    _, _, stats, areas, _, heat_losses = self.component_statistics(
+                        grayscale_crop, mask, b, ac, taf, co, d, bw, min_temp, max_temp)
+                    keep = self.select_zones(stats[1:, cv2.CC_STAT_AREA], heat_losses, bw / d)
+                    areas, heat_losses = areas[keep], heat_losses[keep]
+                    row.update(zones=len(areas), total_area=float(areas.sum()),
+                               total_heat_loss=float(heat_losses.sum()))
+                else:
+                    contours, hierarchy = cv2.findContours(mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE,
+                                                           offset=(x0, y0))
+                    data = self.calculate_heat_loss(image, grayscale_map, contours, hierarchy, b, ac, taf, co,
+                                                    d, bw, min_temp, max_temp)
+                    row.update(zones=len(data), total_area=float(sum(zone.area for zone in data)),
+                               total_heat_loss=float(sum(zone.heat_loss for zone in data)))
+            rows.append(row)
+
+        return rows
+
+    def _sweep_masks(self, grayscale_map, thresholds):
+        """
+        Máscaras de zonas de cada umbral para `sweep_thresholds`.
+
+        :return: generador de tuple (umbral, máscara recortada o None si no hay zonas, origen (x, y) del recorte)
+        """
 
-        temperature_map = self.calculate_temperature_map(grayscale_map, min_temp, max_temp)
-        histogram = self.calculate_histogram(temperature_map, min_temp, max_temp)
+        if self.segmentation != 'threshold':
+            for threshold in thresholds:
+                yield threshold, self.calculate_zone_mask(grayscale_map, threshold), (0, 0)
+            return
+
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        opened = cv2.morphologyEx(grayscale_map, cv2.MORPH_OPEN, kernel)
+
+        # Píxeles de la apertura por encima de cada nivel: hot_pixels[t] = (apertura > t).sum()
+        hot_pixels = np.append(np.cumsum(grey_level_counts(opened)[::-1])[::-1][1:], 0)
+
+        ys, xs = np.nonzero(opened > min(thresholds, default=255))
+        if len(ys):
+            y0, y1, x0, x1 = ys.min(), ys.max() + 1, xs.min(), xs.max() + 1
+            opened = opened[y0:y1, x0:x1]
+
+        for threshold in thresholds:
+            if len(ys) and hot_pixels[min(max(threshold, 0), 255)] > 0:
+                yield threshold, cv2.threshold(opened, threshold, 255, cv2.THRESH_BINARY)[1], (int(x0), int(y0))
+            else:
+                yield threshold, None, (0, 0)
+
+    def process_tiled(self, image, b, ac, taf, co, d, bw, min_temp, max_temp, threshold_hot=200, tile_size=2048,
+                      grayscale_path=None, denoise=None):
+        """
+        Procesa la imagen por mosaicos para imágenes que no caben en memoria (por ejemplo panorámicas).
+
+        Cada mosaico se filtra y se convierte a gris con un margen suficiente para que el resultado sea igual
+        al de la imagen completa, y el mapa en escala de grises se escribe en un array mapeado en disco. Las
+        zonas se miden como en el motor 'components' y se unen entre mosaicos, así que la memoria depende del
+        tamaño del mosaico y no del de la imagen. Para que la entrada tampoco se cargue entera, `image` puede
+        ser un array mapeado en memoria (ver `utils.load_image_file` con archivos .npy).
+
+        :param tile_size: lado en píxeles de los mosaicos
+        :param grayscale_path: archivo .npy donde conservar el mapa en escala de grises; si no se indica se
+            usa un temporal que se elimina al terminar
+        :param denoise: filtro de ruido para esta imagen; por defecto el del procesador
+        :return: `ProcessResult` que se desempaqueta como `(zonas, histograma)`
+        """
 
-        data = self.calculate_heat_loss(image, grayscale_map, contours, hierarchy, b, ac, taf, co, d, bw, min_temp, max_temp)
-        return data, histogram
+        if self.segmentation != 'threshold':
+            raise ValueError('El procesamiento por mosaicos solo admite la segmentación por umbral')
+
+        height, width = image.shape[:2]
+        denoise = self.denoise_filter(denoise)
+        collector = self.collector
+        metrics = None
+        if collector is not None:
+            metrics = collector.start(height=height, width=width, zone_engine='tiled', threshold_hot=threshold_hot,
+                                      tile_size=tile_size)
+
+        keep_grayscale = grayscale_path is not None
+        if not keep_grayscale:
+            fd, grayscale_path = tempfile.mkstemp(suffix='.npy')
+            os.close(fd)
+        grayscale_map = np.lib.format.open_memmap(grayscale_path, mode='w+', dtype=np.uint8, shape=(height, width))
+
+        try:
+            # Filtrado y mapa en escala de grises
+            grey_counts = np.zeros(256, dtype=np.int64)
+            for _, _, y0, x0, y1, x1 in iter_tiles(height, width, tile_size):
+                (py0, px0, py1, px1), inner = padded_window(y0, x0, y1, x1, height, width, denoise.halo)
+                with self.measure_stage('apply_denoise_filter'):
+                    filtered = self.apply_denoise_filter(np.ascontiguousarray(image[py0:py1, px0:px1]), denoise)
+                    filtered = filtered[inner]
+                with self.measure_stage('calculate_grayscale_map'):
+                    grey = self.calculate_grayscale_map(filtered)
+                grayscale_map[y0:y1, x0:x1] = grey
+                grey_counts += np.bincount(grey.ravel(), minlength=256)
+                if collector is not None:
+                    collector.record_array('filtered_tile', filtered)
+
+            with self.measure_stage('calculate_histogram'):
+                grey_temps = self.calculate_temperature_lut(min_temp, max_temp, np.float64)
+                counts, edges = np.histogram(grey_temps, bins=50, range=(min_temp, max_temp), weights=grey_counts)
+                histogram = counts.astype(np.int64), edges
+
+            # Zonas calientes por mosaico, unidas a través de los bordes
+            merger = TileComponentMerger()
+            for row, col, y0, x0, y1, x1 in iter_tiles(height, width, tile_size):
+                (py0, px0, py1, px1), inner = padded_window(y0, x0, y1, x1, height, width, MASK_HALO)
+                with self.measure_stage('find_hot_zones'):
+                    mask = self.calculate_hot_mask(np.asarray(grayscale_map[py0:py1, px0:px1]), threshold_hot)
+                    mask = np.ascontiguousarray(mask[inner])
+                with self.measure_stage('calculate_heat_loss'):
+                    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+                    grey_sums = np.bincount(labels.ravel(), weights=grayscale_map[y0:y1, x0:x1].ravel(),
+                                            minlength=num_labels)
+                    merger.add_tile(row, col, y0, x0, labels, stats, grey_sums)
+                if collector is not None:
+                    collector.record_array('labels_tile', labels)
+
+            with self.measure_stage('calculate_heat_loss'):
+                px_per_meter = bw / d
+                components = merger.components()
+                areas_px = np.array([c[0] for c in components], dtype=np.float64)
+                grey_sums = np.array([c[1] for c in components], dtype=np.float64)
+                areas = areas_px / px_per_meter ** 2
+                mean_temps = grey_sums / np.maximum(areas_px, 1) / 255 * (max_temp - min_temp) + min_temp
+                heat_losses = self.calculate_zone_heat_loss(areas, mean_temps, b, ac, taf, co)
+                data = [HeatZone(image, None, [], areas[i], mean_temps[i], heat_losses[i], bbox=components[i][2])
+                        for i in self.select_zones(areas_px, heat_losses, px_per_meter)]
+        finally:
+            grayscale_map.flush()
+            del grayscale_map
+            if not keep_grayscale:
+                os.remove(grayscale_path)
+
+        if collector is not None:
+            collector.record('zones', len(data))
+
+        return ProcessResult(data, histogram, metrics)
+
+    def measure_stage(self, name):
+        """Contexto que mide una etapa si hay recolector de métricas; si no, no hace nada."""
+
+        if self.collector is None:
+            return _NO_STAGE
+        return self.collector.stage(name)
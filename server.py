@@ -0,0 +1,348 @@
+import os
+import re
+import json
+import time
+import uuid
+import argparse
+import threading
+import configparser as cp
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+import cv2
+import numpy as np
+
+from settings import CO
+from cache import ResultCache
+from export import zone_records
+from filters import select_denoise_filter
+from palette import calibrate_palette
+from processor import ThermalImageProcessor, ZONE_ENGINES
+from utils import generate_pdf_report, parse_config, celsius_to_kelvin
+
+DEFAULT_PORT = 8000
+MAX_UPLOAD_BYTES = 64 << 20
+REPORT_NAME = re.compile(r'^/reports/([0-9a-f]{32})\.pdf$')
+REPORT_FILE = re.compile(r'^[0-9a-f]{32}\.pdf$')
+
+
+class ServiceBusy(Exception):
+    """La cola de análisis está llena; el cliente debe reintentar más tarde."""
+
+
+class AnalysisService:
+    """
+    Pool de hilos con un `ThermalImageProcessor` ya inicializado (paleta y tabla de búsqueda cargadas) por
+    hilo. Admite a lo sumo `workers` análisis en curso y `queue_size` en espera; por encima de ese límite
+    `submit` rechaza la petición con `ServiceBusy` en lugar de acumularla.
+
+    Los reportes PDF se borran cuando tienen más de `report_ttl` segundos y, si aun así hay más de
+    `max_reports`, se borran los más antiguos (ver `prune_reports`). None desactiva cada límite.
+    """
+
+    def __init__(self, workers=2, queue_size=8, lut_bits=None, zone_engine='contours', cache=None,
+                 reports_dir=os.path.join('output', 'server'), zone_workers=1, report_ttl=3600, max_reports=1000):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.lut_bits = lut_bits
+        self.zone_engine = zone_engine
+        self.zone_workers = zone_workers
+        self.cache = cache
+        self.reports_dir = reports_dir
+        self.report_ttl = report_ttl
+        self.max_reports = max_reports
+        os.makedirs(reports_dir, exist_ok=True)
+
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='server')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._local = threading.local()
+        self._processors = []
+        self._lock = threading.Lock()
+        self._reports_lock = threading.Lock()
+        self.pending = 0
+
+        # Crear el procesador de cada hilo antes de recibir peticiones: la barrera obliga a que cada tarea
+        # de calentamiento ocupe un hilo distinto
+        barrier = threading.Barrier(workers)
+        warmup = [self.executor.submit(self._warm_up, barrier) for _ in range(workers)]
+        for future in warmup:
+            future.result()
+
+    def _warm_up(self, barrier):
+        self._processor()
+        barrier.wait()
+
+    def _processor(self):
+        if not hasattr(self._local, 'processor'):
+            self._local.processor = ThermalImageProcessor(self.lut_bits, self.zone_engine, cache=self.cache,
+                                                          zone_workers=self.zone_workers)
+            with self._lock:
+                self._processors.append(self._local.processor)
+        return self._local.processor
+
+    def submit(self, image_bytes, config, threshold_hot=200, pdf=False):
+        """
+        Encola el análisis de una imagen codificada (JPEG, PNG...).
+
+        :param config: dict de `utils.parse_config`
+        :return: `concurrent.futures.Future` con el dict de resultados de `analyze`
+        :raises ServiceBusy: si ya hay `workers + queue_size` análisis en curso o en espera
+        """
+
+        if not self._slots.acquire(blocking=False):
+            raise ServiceBusy()
+
+        with self._lock:
+            self.pending += 1
+        future = self.executor.submit(self.analyze, image_bytes, config, threshold_hot, pdf)
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _):
+        with self._lock:
+            self.pending -= 1
+        self._slots.release()
+
+    def analyze(self, image_bytes, config, threshold_hot=200, pdf=False):
+        """
+        Procesa una imagen con el procesador del hilo actual.
+
+        :return: dict con la tabla de zonas, los totales, el tiempo de procesamiento y, si `pdf`, el
+            identificador del reporte generado (None si no se pidió)
+        """
+
+        start = time.perf_counter()
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError('No se pudo decodificar la imagen')
+
+        processor = self._processor()
+        palette = calibrate_palette(processor, image, config)
+        if palette is not None:
+            image = palette.mask(image)
+
+        result = processor.process(
+            image,
+            config['fuel_flow'],
+            config['heat_transfer_coeff'],
+            celsius_to_kelvin(config['ambient_temp']),
+            CO,
+            config['boiler_width_m'],
+            config['boiler_width_px'],
+            celsius_to_kelvin(config['min_temp']),
+            celsius_to_kelvin(config['max_temp']),
+            threshold_hot,
+            select_denoise_filter(config),
+        )
+
+        report = None
+        if pdf:
+            report = uuid.uuid4().hex
+            with open(self.report_path(report), 'wb') as f:
+                generate_pdf_report(result.zones, result.histogram, stream=f, workers=processor.zone_workers)
+            self.prune_reports()
+
+        records = zone_records(result.zones)
+        for record in records:
+            del record['image']
+
+        return {
+            'zones': records,
+            'total_area': sum(zone.area for zone in result.zones),
+            'total_heat_loss': sum(zone.heat_loss for zone in result.zones),
+            'processing_time': time.perf_counter() - start,
+            'report': report,
+        }
+
+    def report_path(self, report):
+        return os.path.join(self.reports_dir, f'{report}.pdf')
+
+    def prune_reports(self):
+        """
+        Borra los reportes vencidos (`report_ttl`) y los más antiguos por encima de `max_reports`.
+
+        :return: número de reportes borrados
+        """
+
+        with self._reports_lock:
+            reports = []
+            for entry in os.scandir(self.reports_dir):
+                if REPORT_FILE.match(entry.name):
+                    try:
+                        reports.append((entry.stat().st_mtime, entry.path))
+                    except FileNotFoundError:
+                        pass
+            reports.sort()
+
+            expired = 0
+            if self.report_ttl is not None:
+                limit = time.time() - self.report_ttl
+                expired = sum(1 for mtime, _ in reports if mtime < limit)
+            if self.max_reports is not None:
+                expired = max(expired, len(reports) - self.max_reports)
+
+            for _, path in reports[:expired]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+        return expired
+
+    def status(self):
+        return {'workers': self.workers, 'queue_size': self.queue_size, 'pending': self.pending}
+
+    def shutdown(self):
+        """Espera a los análisis en curso, descarta los que están en espera y detiene todos los hilos."""
+
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        for processor in self._processors:
+            processor.close()
+
+
+def parse_request_config(query):
+    """
+    Convierte los parámetros de una petición en la configuración de `utils.parse_config`. Los parámetros se
+    llaman como en la sección [parameters] del .ini (`min_temperature`, `fuel_flow`...); los que empiezan
+    por `filter.` o `palette.` forman las secciones [filter] y [palette] (`filter.name=median&filter.ksize=5`,
+    `palette.colorbar=200,10,12,230`).
+    """
+
+    config = cp.ConfigParser()
+    sections = {'parameters': {}}
+    for key, value in query.items():
+        section, _, option = key.rpartition('.')
+        sections.setdefault(section or 'parameters', {})[option] = value
+    config.read_dict(sections)
+    return parse_config(config)
+
+
+class AnalysisRequestHandler(BaseHTTPRequestHandler):
+    """
+    `POST /analyze?<parámetros>` con la imagen como cuerpo devuelve la tabla de zonas en JSON (con
+    `pdf=1` también la ruta `/reports/<id>.pdf` del reporte). `GET /status` informa la ocupación del pool.
+    Si la cola está llena se responde 503 con `Retry-After`.
+    """
+
+    server_version = 'BoilerHeatLoss/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        service = self.server.service
+        path = urlsplit(self.path).path
+        if path == '/status':
+            self.send_json(200, service.status())
+            return
+
+        match = REPORT_NAME.match(path)
+        if match is None or not os.path.exists(service.report_path(match.group(1))):
+            self.send_json(404, {'error': 'No encontrado'})
+            return
+
+        with open(service.report_path(match.group(1)), 'rb') as f:
+            data = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/analyze':
+            self.send_json(404, {'error': 'No encontrado'})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_UPLOAD_BYTES:
+            self.send_json(413, {'error': f'La imagen supera {MAX_UPLOAD_BYTES} bytes'},
+                           {'Connection': 'close'})
+            self.close_connection = True
+            return
+        image_bytes = self.rfile.read(length)
+
+        query = dict(parse_qsl(url.query))
+        try:
+            threshold_hot = int(query.pop('threshold_hot', 200))
+            pdf = query.pop('pdf', '0').lower() in ('1', 'true', 'yes')
+            config = parse_request_config(query)
+            future = self.server.service.submit(image_bytes, config, threshold_hot, pdf)
+            result = future.result()
+        except ServiceBusy:
+            self.send_json(503, {'error': 'Cola de análisis llena'}, {'Retry-After': '1'})
+            return
+        except (ValueError, cp.Error) as ex:
+            self.send_json(400, {'error': f'{type(ex).__name__}: {ex}'})
+            return
+        except Exception as ex:
+            self.send_json(500, {'error': f'{type(ex).__name__}: {ex}'})
+            return
+
+        if result['report'] is not None:
+            result['report'] = f"/reports/{result['report']}.pdf"
+        self.send_json(200, result)
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+def create_server(host='127.0.0.1', port=DEFAULT_PORT, quiet=False, **service_options):
+    """
+    Crea el servidor HTTP con su `AnalysisService` (ver sus parámetros en `service_options`). Con `port=0`
+    se elige un puerto libre, disponible en `server.server_address`.
+    """
+
+    server = ThreadingHTTPServer((host, port), AnalysisRequestHandler)
+    server.service = AnalysisService(**service_options)
+    server.quiet = quiet
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Servicio HTTP local de análisis de imágenes térmicas')
+    parser.add_argument('--host', help='Dirección donde escuchar', required=False, default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, help='Puerto', required=False, default=DEFAULT_PORT)
+    parser.add_argument('-w', '--workers', type=int, help='Análisis simultáneos', required=False, default=2)
+    parser.add_argument('-q', '--queue-size', type=int, help='Análisis en espera antes de responder 503',
+                        required=False, default=8)
+    parser.add_argument('-o', '--output-folder', help='Carpeta de los reportes PDF', required=False,
+                        default=os.path.join('output', 'server'))
+    parser.add_argument('--lut-bits', type=int, help='Usar tabla de búsqueda en caché con estos bits por canal',
+                        required=False, default=None)
+    parser.add_argument('--zone-engine', choices=ZONE_ENGINES, help='Motor de medición de zonas', required=False,
+                        default='contours')
+    parser.add_argument('--zone-workers', type=int, help='Hilos por análisis para medir zonas y miniaturas',
+                        required=False, default=1)
+    parser.add_argument('--report-ttl', type=float, help='Segundos que se conserva cada reporte PDF',
+                        required=False, default=3600)
+    parser.add_argument('--max-reports', type=int, help='Reportes PDF conservados como máximo', required=False,
+                        default=1000)
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false',
+                        help='No leer ni guardar resultados intermedios en la caché')
+    args = parser.parse_args()
+
+    httpd = create_server(args.host, args.port, workers=args.workers, queue_size=args.queue_size,
+                          lut_bits=args.lut_bits, zone_engine=args.zone_engine,
+                          cache=ResultCache() if args.use_cache else None, reports_dir=args.output_folder,
+                          zone_workers=args.zone_workers, report_ttl=args.report_ttl,
+                          max_reports=args.max_reports)
+    print(f'Escuchando en http://{args.host}:{httpd.server_address[1]}')
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        httpd.service.shutdown()
@@ -1,3 +1,5 @@
+import os
+
 # Definir la paleta de colores en escala de grises
 PALETTE = {
     (255, 255, 255): 255,  # blanco
@@ -15,3 +17,16 @@ AC = 15  # Coeficiente de transferencia de calor por convección para gases (W/m
 TAF = 306  # Temperatura ambiente (K)
 CO = 5.97e-08  # Constante de Stefan Boltzmann (W/m2*k^4)
 DIAMETER = 1.35  # Largo de la caldera en la imagen (m)
+
+# Carpeta de caché para las tablas de búsqueda color -> gris
+LUT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'boiler_heat_loss')
+
+# Paletas leídas de la barra de colores de cada cámara (ver palette.load_colorbar_palette)
+PALETTE_CACHE_DIR = os.path.join(LUT_CACHE_DIR, 'palettes')
+
+# Caché de resultados intermedios (imagen filtrada, mapa en escala de grises y zonas) y su tamaño máximo
+RESULT_CACHE_DIR = os.path.join(LUT_CACHE_DIR, 'results')
+RESULT_CACHE_MAX_BYTES = 1 << 30
+
+# Lado mayor (px) de las miniaturas de zonas en los reportes
+THUMBNAIL_SIZE = 160
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# Los módulos del proyecto están en la raíz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import synthetic_frame, default_parameters  # noqa: E402
+from processor import ThermalImageProcessor  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def synthetic():
+    """Imagen sintética de 320x240 con zonas calientes (la del benchmark) y sus parámetros físicos en orden."""
+
+    image = synthetic_frame(ThermalImageProcessor(), 320, 240, 25)
+    return image, tuple(default_parameters(320).values())
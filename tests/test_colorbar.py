@@ -0,0 +1,59 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import palette
+from settings import PALETTE
+from utils import interpolate_palette, palette_to_arrays, load_image_file
+
+CALDERA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'caldera')
+REGION = (200, 10, 12, 230)
+
+
+@pytest.fixture(autouse=True)
+def empty_palettes(monkeypatch):
+    monkeypatch.setattr(palette, '_palettes', {})
+
+
+def thermogram(colors, quality):
+    """Copia de caldera/1.jpg con `colors` (del más frío al más caliente) dibujados como barra vertical."""
+
+    image = cv2.imread(os.path.join(CALDERA, '1.jpg'))
+    x, y, w, h = REGION
+    rows = np.interp(np.linspace(len(colors) - 1, 0, h), np.arange(len(colors)), np.arange(len(colors)))
+    image[y:y + h, x:x + w] = colors[np.rint(rows).astype(int)][:, None, :]
+    return cv2.imdecode(cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1], cv2.IMREAD_COLOR)
+
+
+def test_colorbar_without_camera_is_stable(tmp_path):
+    """Sin cámara, el ruido JPEG de cada barra no cambia la paleta; una barra distinta sí la sustituye."""
+
+    colors = palette_to_arrays(interpolate_palette(PALETTE))[0]
+    first = palette.load_colorbar_palette(thermogram(colors, 95), REGION, cache_dir=tmp_path)
+    second = palette.load_colorbar_palette(thermogram(colors, 70), REGION, cache_dir=tmp_path)
+    assert second is first
+
+    # Otro proceso lee la paleta del disco
+    palette._palettes.clear()
+    third = palette.load_colorbar_palette(thermogram(colors, 80), REGION, cache_dir=tmp_path)
+    np.testing.assert_array_equal(third.colors, first.colors)
+    assert third.signature == first.signature
+
+    other = palette.load_colorbar_palette(thermogram(colors[::-1], 95), REGION, cache_dir=tmp_path)
+    assert np.abs(other.colors - first.colors[::-1]).mean() <= palette.COLORBAR_TOLERANCE
+
+
+def test_mask_keeps_memmap(tmp_path):
+    """La barra se tapa sin cargar entera una imagen mapeada en memoria ni modificar el archivo."""
+
+    image = cv2.imread(os.path.join(CALDERA, '1.jpg'))
+    path = str(tmp_path / 'image.npy')
+    np.save(path, image)
+
+    bar = palette.ColorbarPalette(np.zeros((256, 3)), REGION)
+    masked = bar.mask(load_image_file(path))
+    assert isinstance(masked, np.memmap)
+    np.testing.assert_array_equal(masked, bar.mask(image))
+    np.testing.assert_array_equal(np.load(path), image)
@@ -0,0 +1,35 @@
+import os
+import glob
+
+import cv2
+import numpy as np
+import pytest
+
+from settings import PALETTE
+from utils import interpolate_palette, palette_to_arrays, nearest_color, nearest_color_map, nearest_palette_values
+
+CALDERA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'caldera')
+SAMPLES = 2000
+
+
+@pytest.fixture(scope='module')
+def palette():
+    return interpolate_palette(PALETTE)
+
+
+@pytest.mark.parametrize('image_path', sorted(glob.glob(os.path.join(CALDERA, '*.jpg'))))
+def test_nearest_color_map_matches_nearest_color(palette, image_path):
+    """El mapa vectorizado coincide con el recorrido píxel a píxel de `nearest_color` en las muestras."""
+
+    image = cv2.imread(image_path)
+    colors, values = palette_to_arrays(palette)
+
+    rng = np.random.default_rng(0)
+    rows = rng.integers(0, image.shape[0], SAMPLES)
+    cols = rng.integers(0, image.shape[1], SAMPLES)
+    expected = np.array([nearest_color(tuple(image[y, x]), palette) for y, x in zip(rows, cols)], dtype=np.uint8)
+
+    # Bandas y bloques pequeños para recorrer también la división en mosaicos
+    grayscale_map = nearest_color_map(image, colors, values, tile_pixels=image.shape[1] * 37, chunk_size=500)
+    np.testing.assert_array_equal(grayscale_map[rows, cols], expected)
+    np.testing.assert_array_equal(nearest_palette_values(image[rows, cols], colors, values), expected)
@@ -0,0 +1,21 @@
+import pytest
+
+from processor import ThermalImageProcessor
+
+THRESHOLDS = [150, 180, 200, 215, 230, 255]
+
+
+@pytest.mark.parametrize('zone_engine', ['contours', 'components'])
+def test_sweep_matches_process(synthetic, zone_engine):
+    """Cada fila del barrido coincide con `process` a ese umbral (la apertura conmuta con la umbralización)."""
+
+    image, params = synthetic
+    processor = ThermalImageProcessor(zone_engine=zone_engine)
+    rows = processor.sweep_thresholds(image, *params, THRESHOLDS)
+
+    assert [row['threshold'] for row in rows] == THRESHOLDS
+    for row in rows:
+        zones = processor.process(image, *params, row['threshold']).zones
+        assert row['zones'] == len(zones)
+        assert row['total_area'] == pytest.approx(sum(zone.area for zone in zones))
+        assert row['total_heat_loss'] == pytest.approx(sum(zone.heat_loss for zone in zones))
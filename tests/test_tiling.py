@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from processor import ThermalImageProcessor
+
+
+def zone_summary(zones):
+    return sorted((zone.bbox, zone.area, zone.mean_temp, zone.heat_loss) for zone in zones)
+
+
+@pytest.mark.parametrize('tile_size', [16, 37, 64, 500])
+def test_process_tiled_matches_components(synthetic, tile_size):
+    """Las zonas unidas entre mosaicos son las mismas que las del motor 'components' sobre la imagen completa."""
+
+    image, params = synthetic
+    processor = ThermalImageProcessor(zone_engine='components')
+    expected = processor.process(image, *params, 200)
+    result = processor.process_tiled(image, *params, 200, tile_size=tile_size)
+
+    assert expected.zones
+    assert zone_summary(result.zones) == zone_summary(expected.zones)
+    np.testing.assert_array_equal(result.histogram[0], expected.histogram[0])
+    np.testing.assert_array_equal(result.histogram[1], expected.histogram[1])
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from benchmark import default_parameters
+from processor import ThermalImageProcessor
+from video import process_frames
+
+
+@pytest.fixture(scope='module')
+def sequence():
+    """
+    Secuencia de 30 cuadros de 64x60 en la que cada cuadro agrega o borra un bloque caliente de 3 a 8 píxeles,
+    de modo que los cambios caen cerca de los bordes de mosaicos pequeños.
+    """
+
+    processor = ThermalImageProcessor()
+    colors = processor.palette_colors[np.argsort(processor.palette_values, kind='stable')].astype(np.uint8)
+    rng = np.random.default_rng(0)
+    grey = np.full((60, 64), 80, dtype=np.uint8)
+    frames = []
+    for index in range(30):
+        grey = grey.copy()
+        y, x = rng.integers(0, 56, 2)
+        size = int(rng.integers(3, 9))
+        grey[y:y + size, x:x + size] = int(rng.integers(215, 256)) if rng.random() < 0.6 else 80
+        frames.append((index, float(index), colors[grey]))
+
+    return frames, tuple(default_parameters(64).values())
+
+
+@pytest.mark.parametrize('tile_size', [1, 2, 3, 16])
+def test_process_frames_matches_process(sequence, tile_size):
+    """Cada fila incremental coincide con procesar el cuadro desde cero, también con mosaicos pequeños."""
+
+    frames, params = sequence
+    processor = ThermalImageProcessor(zone_engine='components', denoise='none')
+    rows = list(process_frames(processor, frames, *params, 200, tile_size=tile_size))
+
+    assert len(rows) == len(frames)
+    assert any(row['zones'] for row in rows)
+    for row, (_, _, frame) in zip(rows, frames):
+        zones = processor.process(frame, *params, 200).zones
+        assert row['zones'] == len(zones)
+        assert row['total_area'] == pytest.approx(sum(zone.area for zone in zones))
+        assert row['total_heat_loss'] == pytest.approx(sum(zone.heat_loss for zone in zones))
@@ -0,0 +1,127 @@
+import numpy as np
+
+
+def iter_tiles(height, width, tile_size):
+    """
+    Recorre la imagen en mosaicos de `tile_size` x `tile_size` píxeles, fila por fila.
+
+    :return: generador de tuple (fila, columna, y0, x0, y1, x1) con el índice del mosaico y sus límites
+    """
+
+    for row, top in enumerate(range(0, height, tile_size)):
+        for col, left in enumerate(range(0, width, tile_size)):
+            yield row, col, top, left, min(top + tile_size, height), min(left + tile_size, width)
+
+
+def padded_window(y0, x0, y1, x1, height, width, halo):
+    """
+    Amplía los límites de un mosaico con un margen de `halo` píxeles recortado a la imagen.
+
+    :return: tuple (límites ampliados (y0, x0, y1, x1), recorte (filas, columnas) que devuelve el mosaico)
+    """
+
+    py0, px0 = max(y0 - halo, 0), max(x0 - halo, 0)
+    py1, px1 = min(y1 + halo, height), min(x1 + halo, width)
+    return (py0, px0, py1, px1), (slice(y0 - py0, y1 - py0), slice(x0 - px0, x1 - px0))
+
+
+class TileComponentMerger:
+    """
+    Une las componentes conexas (conectividad 8) calculadas mosaico a mosaico en componentes globales.
+
+    Solo se guardan las estadísticas de cada componente y las etiquetas del último borde inferior y derecho
+    de cada mosaico, de modo que la memoria no depende del tamaño de la imagen sino del número de zonas.
+    """
+
+    def __init__(self):
+        self.parent = []
+        self.area = []
+        self.grey_sum = []
+        self.bbox = []  # [x0, y0, x1, y1] inclusivo
+        self.bottom_edges = {}
+        self.right_edges = {}
+
+    def _find(self, label):
+        while self.parent[label] != label:
+            self.parent[label] = self.parent[self.parent[label]]
+            label = self.parent[label]
+        return label
+
+    def _union(self, a, b):
+        a, b = self._find(a), self._find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+    def _union_edges(self, edge_a, edge_b):
+        """Une las etiquetas de dos bordes adyacentes, incluidos los vecinos en diagonal."""
+
+        for shift in (-1, 0, 1):
+            a = edge_a[max(shift, 0):len(edge_a) + min(shift, 0)]
+            b = edge_b[max(-shift, 0):len(edge_b) + min(-shift, 0)]
+            for la, lb in set(zip(a[(a >= 0) & (b >= 0)].tolist(), b[(a >= 0) & (b >= 0)].tolist())):
+                self._union(la, lb)
+
+    def add_tile(self, row, col, top, left, labels, stats, grey_sums):
+        """
+        Agrega las componentes de un mosaico.
+
+        :param labels: etiquetas locales del mosaico (0 = fondo)
+        :param stats: estadísticas de `cv2.connectedComponentsWithStats`
+        :param grey_sums: suma de niveles de gris por etiqueta local
+        """
+
+        offset = len(self.parent)
+        count = len(stats) - 1
+        self.parent.extend(range(offset, offset + count))
+        self.area.extend(stats[1:, 4].tolist())
+        self.grey_sum.extend(grey_sums[1:].tolist())
+        for x, y, w, h in stats[1:, :4].tolist():
+            self.bbox.append([left + x, top + y, left + x + w - 1, top + y + h - 1])
+
+        # Etiquetas globales (-1 = fondo) de los bordes del mosaico
+        to_global = np.concatenate([[-1], np.arange(offset, offset + count)])
+        top_edge, left_edge = to_global[labels[0]], to_global[labels[:, 0]]
+        self.bottom_edges[(row, col)] = to_global[labels[-1]]
+        self.right_edges[(row, col)] = to_global[labels[:, -1]]
+
+        if (row, col - 1) in self.right_edges:
+            self._union_edges(self.right_edges[(row, col - 1)], left_edge)
+        if (row - 1, col) in self.bottom_edges:
+            self._union_edges(self.bottom_edges[(row - 1, col)], top_edge)
+
+        # Esquinas compartidas con los mosaicos en diagonal
+        if (row - 1, col - 1) in self.bottom_edges:
+            corner = self.bottom_edges[(row - 1, col - 1)][-1]
+            if corner >= 0 and top_edge[0] >= 0:
+                self._union(corner, top_edge[0])
+        if (row - 1, col + 1) in self.bottom_edges:
+            corner = self.bottom_edges[(row - 1, col + 1)][0]
+            if corner >= 0 and top_edge[-1] >= 0:
+                self._union(corner, top_edge[-1])
+
+        # Bordes que ningún mosaico posterior vuelve a consultar
+        self.bottom_edges.pop((row - 1, col - 1), None)
+        self.right_edges.pop((row, col - 1), None)
+
+    def components(self):
+        """
+        Devuelve las componentes globales ordenadas por su primera fila y columna.
+
+        :return: lista de tuple (área en píxeles, suma de gris, bbox (x, y, ancho, alto))
+        """
+
+        merged = {}
+        for label in range(len(self.parent)):
+            root = self._find(label)
+            x0, y0, x1, y1 = self.bbox[label]
+            if root not in merged:
+                merged[root] = [0, 0.0, x0, y0, x1, y1]
+            entry = merged[root]
+            entry[0] += self.area[label]
+            entry[1] += self.grey_sum[label]
+            entry[2:] = [min(entry[2], x0), min(entry[3], y0), max(entry[4], x1), max(entry[5], y1)]
+
+        result = [(area, grey_sum, (x0, y0, x1 - x0 + 1, y1 - y0 + 1))
+                  for area, grey_sum, x0, y0, x1, y1 in merged.values()]
+        result.sort(key=lambda c: (c[2][1], c[2][0]))
+        return result
@@ -1,11 +1,22 @@
 import os
 import cv2
+import glob
 import time
 import numpy as np
-from pdf import PDF
+from io import BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import configparser as cp
 from datetime import datetime
 
+from palette import parse_region
+from filters import parse_filter_value
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.npy')
+HISTOGRAM_TITLE = 'Histograma de la Imagen Térmica'
+HISTOGRAM_XLABEL = 'Valor de temperatura (K)'
+HISTOGRAM_YLABEL = 'Frecuencia'
+
 
 def interpolate_color(color1, color2, ratio):
     """
@@ -70,7 +81,9 @@ def kelvin_to_celsius(k):
 def calculate_distance(color1, color2):
     """Calcula la distancia euclidiana entre dos colores RGB"""
 
-    return ((color1[2] - color2[2]) ** 2 + (color1[1] - color2[1]) ** 2 + (color1[0] - color2[0]) ** 2) ** 0.5
+    # Convertir a int evita el desbordamiento cuando los colores provienen de un array uint8
+    return ((int(color1[2]) - int(color2[2])) ** 2 + (int(color1[1]) - int(color2[1])) ** 2 +
+            (int(color1[0]) - int(color2[0])) ** 2) ** 0.5
 
 
 def nearest_color(color, palette):
@@ -93,8 +106,163 @@ def nearest_color(color, palette):
     return palette[min_color]
 
 
-def generate_pdf_report(data, histogram, output_folder):
-    """Generar reporte PDF"""
+def palette_to_arrays(palette):
+    """
+    Convierte una paleta en arrays de NumPy conservando el orden del diccionario.
+
+    :param palette: dict
+    :return: tuple (colores (N, 3) int32, valores (N,) uint8)
+    """
+
+    colors = np.array(list(palette.keys()), dtype=np.int32).reshape(-1, 3)
+    values = np.array(list(palette.values()), dtype=np.uint8)
+    return colors, values
+
+
+def nearest_color_map(image, colors, values, tile_pixels=1 << 20, chunk_size=4096, stats=None):
+    """
+    Versión vectorizada de `nearest_color` para una imagen completa.
+
+    La imagen se recorre en bandas de filas de como máximo `tile_pixels` píxeles. En cada banda solo se
+    calculan distancias para los colores únicos, en bloques de `chunk_size` colores, lo que limita la
+    memoria a `chunk_size * len(colors)` distancias. Los empates se resuelven a favor del primer color de
+    la paleta, igual que `nearest_color`, por lo que el resultado es idéntico.
+
+    :param image: np.ndarray (alto, ancho, 3) uint8
+    :param colors: np.ndarray (N, 3) con los colores de la paleta
+    :param values: np.ndarray (N,) con los valores en escala de grises
+    :param tile_pixels: int
+    :param chunk_size: int
+    :param stats: dict opcional donde acumular en 'palette_lookups' los colores buscados en la paleta
+    :return: np.ndarray (alto, ancho) uint8
+    """
+
+    height, width = image.shape[:2]
+    grayscale_map = np.empty((height, width), dtype=np.uint8)
+    tile_rows = max(1, tile_pixels // max(width, 1))
+
+    for top in range(0, height, tile_rows):
+        tile = image[top:top + tile_rows].reshape(-1, 3).astype(np.int32)
+        packed = (tile[:, 0] << 16) | (tile[:, 1] << 8) | tile[:, 2]
+        unique, inverse = np.unique(packed, return_inverse=True)
+        unique_colors = np.stack([unique >> 16, (unique >> 8) & 0xFF, unique & 0xFF], axis=1)
+
+        nearest = nearest_palette_values(unique_colors, colors, values, chunk_size)
+        if stats is not None:
+            stats['palette_lookups'] = stats.get('palette_lookups', 0) + len(unique)
+        grayscale_map[top:top + tile_rows] = nearest[inverse.ravel()].reshape(-1, width)
+
+    return grayscale_map
+
+
+def nearest_palette_values(query_colors, colors, values, chunk_size=4096):
+    """
+    Devuelve el valor en escala de grises del color de la paleta más cercano a cada color consultado.
+
+    Usa la expansión |c - p|² = |c|² - 2 c·p + |p|², omitiendo |c|² que no cambia el mínimo. Todos los
+    términos son enteros representables exactamente en float64, así que el resultado coincide con
+    `nearest_color`, incluida la resolución de empates.
+
+    :param query_colors: np.ndarray (M, 3) de enteros
+    :param colors: np.ndarray (N, 3) con los colores de la paleta
+    :param values: np.ndarray (N,) con los valores en escala de grises
+    :param chunk_size: int
+    :return: np.ndarray (M,) uint8
+    """
+
+    palette = colors.astype(np.float64)
+    palette_norms = (palette ** 2).sum(axis=1)
+    nearest = np.empty(len(query_colors), dtype=np.uint8)
+    for start in range(0, len(query_colors), chunk_size):
+        block = query_colors[start:start + chunk_size].astype(np.float64)
+        distances = palette_norms - 2 * block @ palette.T
+        nearest[start:start + chunk_size] = values[distances.argmin(axis=1)]
+
+    return nearest
+
+
+def grey_level_counts(grayscale_map, tile_pixels=1 << 20):
+    """
+    Cuenta los píxeles de cada nivel de gris, como `np.bincount(grayscale_map.ravel(), minlength=256)`.
+
+    `np.bincount` convierte la entrada a enteros de 8 bytes, así que se cuenta por bandas de como máximo
+    `tile_pixels` píxeles para no crear esa copia de la imagen completa.
+
+    :param grayscale_map: np.ndarray uint8
+    :return: np.ndarray (256,) int64
+    """
+
+    rows = grayscale_map.reshape(grayscale_map.shape[0], -1) if grayscale_map.ndim > 1 else grayscale_map[None]
+    tile_rows = max(1, tile_pixels // max(rows.shape[1], 1))
+    counts = np.zeros(256, dtype=np.int64)
+    for top in range(0, rows.shape[0], tile_rows):
+        counts += np.bincount(rows[top:top + tile_rows].ravel(), minlength=256)
+
+    return counts
+
+
+def encode_image(image, extension='.jpg'):
+    """
+    Codifica una imagen de OpenCV en memoria.
+
+    :return: BytesIO listo para `PDF.image`
+    """
+
+    ok, buffer = cv2.imencode(extension, image)
+    if not ok:
+        raise ValueError(f'No se pudo codificar la imagen como {extension}')
+    return BytesIO(buffer.tobytes())
+
+
+def encode_zone_image(zone):
+    """
+    :return: tuple (zona, (alto, ancho) de la miniatura, miniatura codificada en JPEG)
+    """
+
+    thumbnail = zone.thumbnail(cache=False)
+    return zone, thumbnail.shape[:2], encode_image(thumbnail)
+
+
+def iter_zone_images(zones, workers=1):
+    """
+    Recorre las zonas entregando cada una junto a su miniatura codificada en JPEG. Las miniaturas se generan
+    sin guardarlas en las zonas, para no tenerlas todas en memoria a la vez. Con `workers` mayor que 1 se
+    codifican en paralelo, como mucho `2 * workers` por delante de la que se entrega, y siempre en el orden
+    de `zones`.
+    """
+
+    if workers <= 1:
+        for zone in zones:
+            yield encode_zone_image(zone)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='thumbnails') as executor:
+        pending = deque()
+        for zone in zones:
+            pending.append(executor.submit(encode_zone_image, zone))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def generate_pdf_report(data, histogram, output_folder=None, histogram_backend='pdf', stream=None, workers=1):
+    """
+    Generar reporte PDF
+
+    Las imágenes se pasan al PDF desde memoria, sin escribir archivos intermedios.
+
+    :param data: iterable de `HeatZone` (puede ser un generador)
+    :param histogram: tuple (frecuencias, bordes) de `ThermalImageProcessor.calculate_histogram`
+    :param output_folder: carpeta donde guardar `reporte_zonas_calientes.pdf` si no se indica `stream`
+    :param histogram_backend: 'pdf' dibuja el histograma con primitivas del PDF, 'matplotlib' lo renderiza
+        como imagen
+    :param stream: objeto binario con `write` donde escribir el PDF en lugar de la carpeta de salida
+    :param workers: hilos con los que codificar las miniaturas de las zonas (ver `iter_zone_images`)
+    """
+
+    # fpdf se importa solo al generar reportes; el análisis (paleta, mapa de grises, zonas) no lo necesita
+    from pdf import PDF
 
     pdf = PDF()
     pdf.add_page()
@@ -112,27 +280,58 @@ def generate_pdf_report(data, histogram, output_folder):
     pdf.cell(50, 10, 'Pérdida de Calor', 1, 0, 'C')
     pdf.ln(10)
 
-    for idx, (image, area, mean_temp, heat_loss) in enumerate(data):
-        img_path = os.path.join(output_folder, f'zone{idx}.jpg')
-        cv2.imwrite(img_path, image)
+    for zone, (height, width), zone_image in iter_zone_images(data, workers):
+        # Ajustar la miniatura a un cuadro de 40x40 conservando su proporción
+        w, h = (40, 40 * height / width) if width >= height else (40 * width / height, 40)
 
         # Agrega la información de la zona caliente a la tabla
         pdf.set_font('helvetica', '', 10)
         pdf.cell(50, 50, '', 1, 0, 'C')  # Celdas vacías para ajustar el formato
-        pdf.image(img_path, x=pdf.get_x() - 50 + 5, y=pdf.get_y() + 5, w=40, h=40)
-        pdf.cell(50, 50, f'{kelvin_to_celsius(mean_temp):.2f} °C', 1, 0, 'C')
-        pdf.cell(40, 50, f'{area:.6f} m²', 1, 0, 'C')
-        pdf.cell(50, 50, f'{heat_loss:.8f} W/m²', 1, 0, 'C')
+        pdf.image(zone_image, x=pdf.get_x() - 50 + (50 - w) / 2, y=pdf.get_y() + (50 - h) / 2, w=w, h=h)
+        pdf.cell(50, 50, f'{kelvin_to_celsius(zone.mean_temp):.2f} °C', 1, 0, 'C')
+        pdf.cell(40, 50, f'{zone.area:.6f} m²', 1, 0, 'C')
+        pdf.cell(50, 50, f'{zone.heat_loss:.8f} W/m²', 1, 0, 'C')
         pdf.ln(50)
 
-    # Agrega el histograma al PDF con bordes
+    # Agrega el histograma al PDF
     pdf.add_page()
-    histogram_image_file = os.path.join(output_folder, 'histogram.jpg')
-    cv2.imwrite(histogram_image_file, histogram)
-    pdf.image(histogram_image_file, y=pdf.get_y(), w=190, keep_aspect_ratio=True)
+    counts, edges = histogram
+    if histogram_backend == 'matplotlib':
+        pdf.image(encode_image(render_histogram(histogram), '.png'), y=pdf.get_y(), w=190, keep_aspect_ratio=True)
+    else:
+        pdf.bar_chart(counts, edges, HISTOGRAM_TITLE, HISTOGRAM_XLABEL, HISTOGRAM_YLABEL)
 
     # Guarda el archivo PDF
-    pdf.output(os.path.join(output_folder, 'reporte_zonas_calientes.pdf'))
+    if stream is not None:
+        stream.write(pdf.output())
+    else:
+        pdf.output(os.path.join(output_folder, 'reporte_zonas_calientes.pdf'))
+
+
+def render_histogram(histogram):
+    """
+    Dibuja el histograma con matplotlib y lo devuelve como imagen de OpenCV.
+
+    matplotlib se importa solo aquí para no cargarlo en los procesos que no dibujan.
+    """
+
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    counts, edges = histogram
+    fig = Figure()
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge', color='blue', alpha=0.7)
+    ax.set_title(HISTOGRAM_TITLE)
+    ax.set_xlabel(HISTOGRAM_XLABEL)
+    ax.set_ylabel(HISTOGRAM_YLABEL)
+
+    # Volcar la figura a un array sin pasar por un archivo
+    canvas.draw()
+    image = np.asarray(canvas.buffer_rgba())
+
+    return cv2.cvtColor(image, cv2.COLOR_RGBA2BGR)
 
 
 def measure_execution_time(func):
@@ -183,6 +382,15 @@ def load_config_file(config_file):
 
     config = cp.ConfigParser()
     config.read(config_file)
+    return parse_config(config)
+
+
+def parse_config(config):
+    """
+    Extrae los datos de configuración de un `ConfigParser` ya cargado (de un archivo .ini o, en `server.py`,
+    de los parámetros de una petición).
+    """
+
     min_temp = float(config.get('parameters', 'min_temperature'))
     max_temp = float(config.get('parameters', 'max_temperature'))
     boiler_width_px = float(config.get('parameters', 'boiler_width_px'))
@@ -191,6 +399,22 @@ def load_config_file(config_file):
     heat_transfer_coeff = float(config.get('parameters', 'heat_transfer_coeff'))
     ambient_temp = float(config.get('parameters', 'ambient_temp'))
 
+    # Sección opcional [filter]: `name` (ver filters.DENOISE_FILTERS) y los parámetros del filtro
+    denoise = config.get('filter', 'name', fallback=None)
+    denoise_params = {}
+    if config.has_section('filter'):
+        denoise_params = {key: parse_filter_value(value, key) for key, value in config.items('filter') if key != 'name'}
+
+    # Sección opcional [palette]: región `colorbar = x, y, ancho, alto` de la barra de colores, su extremo
+    # caliente `hot_end` y el modelo de cámara `camera` con el que se guarda en caché
+    palette = None
+    if config.has_option('palette', 'colorbar'):
+        palette = {
+            'region': parse_region(config.get('palette', 'colorbar')),
+            'hot_end': config.get('palette', 'hot_end', fallback=None),
+            'camera': config.get('palette', 'camera', fallback=None),
+        }
+
     return {
         "min_temp": min_temp,
         "max_temp": max_temp,
@@ -199,12 +423,33 @@ def load_config_file(config_file):
         "fuel_flow": fuel_flow,
         "heat_transfer_coeff": heat_transfer_coeff,
         "ambient_temp": ambient_temp,
+        "denoise": denoise,
+        "denoise_params": denoise_params,
+        "palette": palette,
     }
 
 
+def find_image_pairs(input_folder):
+    """
+    Busca las parejas imagen/configuración de una carpeta (por ejemplo `caldera/1.jpg` y `caldera/1.ini`).
+    """
+
+    pairs = []
+    for image_path in sorted(glob.glob(os.path.join(input_folder, '*'))):
+        stem, extension = os.path.splitext(image_path)
+        if extension.lower() in IMAGE_EXTENSIONS and os.path.exists(stem + '.ini'):
+            pairs.append((image_path, stem + '.ini'))
+
+    return pairs
+
+
 def load_image_file(image_file):
     """
-    Carga un archivo de imagen.
+    Carga un archivo de imagen. Los archivos .npy (array BGR uint8) se abren mapeados en memoria, sin
+    leerlos completos, para el procesamiento por mosaicos de imágenes muy grandes.
     """
 
+    if os.path.splitext(image_file)[1].lower() == '.npy':
+        return np.load(image_file, mmap_mode='r')
+
     return cv2.imread(image_file)
@@ -0,0 +1,179 @@
+import os
+import csv
+import time
+
+import cv2
+import numpy as np
+
+from processor import MASK_HALO
+from tiling import iter_tiles, padded_window, TileComponentMerger
+from utils import load_image_file
+
+FRAME_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+TIME_SERIES_FIELDS = ['frame', 'time', 'zones', 'total_area', 'total_heat_loss', 'max_mean_temp',
+                      'changed_tiles', 'processing_time']
+
+
+def iter_frames(source, fps=None):
+    """
+    Recorre los cuadros de una grabación (`cv2.VideoCapture`) o de una carpeta de imágenes secuenciales.
+
+    :param source: ruta de un video o de una carpeta con un cuadro por archivo (en orden alfabético)
+    :param fps: cuadros por segundo de la carpeta, para calcular el tiempo de cada cuadro
+    :return: generador de tuple (índice, tiempo en segundos, cuadro BGR)
+    """
+
+    if os.path.isdir(source):
+        paths = sorted(p for p in os.listdir(source) if os.path.splitext(p)[1].lower() in FRAME_EXTENSIONS)
+        for index, path in enumerate(paths):
+            frame = load_image_file(os.path.join(source, path))
+            if frame is not None:
+                yield index, index / fps if fps else float(index), frame
+        return
+
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f'No se pudo abrir el video {source}')
+
+    try:
+        index = 0
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield index, capture.get(cv2.CAP_PROP_POS_MSEC) / 1000, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+def changed_tiles(current, previous, tile_size):
+    """
+    Marca los mosaicos en los que algún píxel de `current` difiere de `previous`.
+
+    :return: np.ndarray bool (filas de mosaicos, columnas de mosaicos)
+    """
+
+    height, width = current.shape[:2]
+    rows, cols = -(-height // tile_size), -(-width // tile_size)
+    changed = np.any(current != previous, axis=2)
+
+    padded = np.zeros((rows * tile_size, cols * tile_size), dtype=bool)
+    padded[:height, :width] = changed
+    return padded.reshape(rows, tile_size, cols, tile_size).any(axis=(1, 3))
+
+
+def process_frames(processor, frames, b, ac, taf, co, d, bw, min_temp, max_temp, threshold_hot=200, tile_size=64):
+    """
+    Procesa una secuencia de cuadros de forma incremental y entrega una fila de la serie temporal por cuadro.
+
+    Cada cuadro se filtra completo y se compara con el cuadro filtrado anterior por mosaicos. Solo los
+    mosaicos que cambiaron se vuelven a convertir a gris, y solo esos mosaicos y los que están a menos de
+    `MASK_HALO` píxeles (hasta donde alcanza la apertura morfológica) vuelven a calcular sus componentes
+    conexas; el resto se reutiliza y las componentes se unen con `TileComponentMerger`. Si ningún mosaico
+    cambió se repite la fila anterior sin recalcular nada. Las zonas se miden como en el motor 'components'
+    y se filtran con `ThermalImageProcessor.select_zones`.
+
+    :param frames: iterable de tuple (índice, tiempo, cuadro), por ejemplo de `iter_frames`
+    :return: generador de dict con las columnas de `TIME_SERIES_FIELDS`
+    """
+
+    if tile_size <= 0:
+        raise ValueError(f'El lado de los mosaicos debe ser positivo, se recibió {tile_size}')
+
+    # Mosaicos vecinos que alcanza el margen de la apertura desde un mosaico que cambió
+    reach = -(-MASK_HALO // tile_size)
+    neighbourhood = np.ones((2 * reach + 1, 2 * reach + 1), np.uint8)
+
+    px_per_meter = bw / d
+    previous = None
+    grayscale_map = None
+    tile_cache = {}
+    summary = None
+
+    for index, timestamp, frame in frames:
+        start = time.perf_counter()
+        with processor.measure_stage('apply_denoise_filter'):
+            filtered = processor.apply_denoise_filter(frame)
+        height, width = filtered.shape[:2]
+
+        with processor.measure_stage('calculate_grayscale_map'):
+            if previous is None or previous.shape != filtered.shape:
+                grayscale_map = processor.calculate_grayscale_map(filtered)
+                changed = np.ones((-(-height // tile_size), -(-width // tile_size)), dtype=bool)
+                tile_cache = {}
+            else:
+                changed = changed_tiles(filtered, previous, tile_size)
+                for row, col in zip(*np.nonzero(changed)):
+                    y0, x0 = row * tile_size, col * tile_size
+                    y1, x1 = min(y0 + tile_size, height), min(x0 + tile_size, width)
+                    grayscale_map[y0:y1, x0:x1] = processor.calculate_grayscale_map(filtered[y0:y1, x0:x1])
+        previous = filtered
+
+        if changed.any():
+            with processor.measure_stage('calculate_heat_loss'):
+                dirty = cv2.dilate(changed.astype(np.uint8), neighbourhood).astype(bool)
+                merger = TileComponentMerger()
+                for row, col, y0, x0, y1, x1 in iter_tiles(height, width, tile_size):
+                    if dirty[row, col] or (row, col) not in tile_cache:
+                        (py0, px0, py1, px1), inner = padded_window(y0, x0, y1, x1, height, width, MASK_HALO)
+                        mask = processor.calculate_hot_mask(grayscale_map[py0:py1, px0:px1], threshold_hot)
+                        num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(
+                            np.ascontiguousarray(mask[inner]), connectivity=8)
+                        grey_sums = np.bincount(labels.ravel(), weights=grayscale_map[y0:y1, x0:x1].ravel(),
+                                                minlength=num_labels)
+                        tile_cache[(row, col)] = (labels, stats, grey_sums)
+                    merger.add_tile(row, col, y0, x0, *tile_cache[(row, col)])
+
+                components = merger.components()
+                areas_px = np.array([c[0] for c in components], dtype=np.float64)
+                grey_sums = np.array([c[1] for c in components], dtype=np.float64)
+                areas = areas_px / px_per_meter ** 2
+                mean_temps = grey_sums / np.maximum(areas_px, 1) / 255 * (max_temp - min_temp) + min_temp
+                heat_losses = processor.calculate_zone_heat_loss(areas, mean_temps, b, ac, taf, co)
+
+                keep = processor.select_zones(areas_px, heat_losses, px_per_meter)
+                areas, mean_temps, heat_losses = areas[keep], mean_temps[keep], heat_losses[keep]
+
+                summary = {
+                    'zones': len(keep),
+                    'total_area': float(areas.sum()),
+                    'total_heat_loss': float(heat_losses.sum()),
+                    'max_mean_temp': float(mean_temps.max()) if len(keep) else float('nan'),
+                }
+
+        yield {
+            'frame': index,
+            'time': timestamp,
+            **summary,
+            'changed_tiles': int(changed.sum()),
+            'processing_time': time.perf_counter() - start,
+        }
+
+
+def write_time_series(rows, output_file):
+    """
+    Guarda la serie temporal: `.npz` guarda un array por columna y cualquier otra extensión se escribe como
+    CSV. El CSV se escribe fila a fila a medida que llegan, sin guardar la serie en memoria.
+
+    :param rows: iterable de dict, por ejemplo de `process_frames`
+    :return: número de filas escritas
+    """
+
+    if os.path.splitext(output_file)[1].lower() != '.npz':
+        count = 0
+        with open(output_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=TIME_SERIES_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        return count
+
+    columns = {field: [] for field in TIME_SERIES_FIELDS}
+    for row in rows:
+        for field in TIME_SERIES_FIELDS:
+            columns[field].append(row[field])
+
+    np.savez_compressed(output_file, **{field: np.asarray(values) for field, values in columns.items()})
+    return len(columns['frame'])
@@ -0,0 +1,130 @@
+import cv2
+import numpy as np
+
+from settings import THUMBNAIL_SIZE
+
+
+class HeatZone:
+    """
+    Resultado de una zona caliente. Solo guarda la geometría y las medidas; la miniatura para el reporte
+    se recorta de la imagen original cuando se pide por primera vez y se conserva en caché.
+    """
+
+    __slots__ = ('contour', 'holes', 'bbox', 'area', 'mean_temp', 'heat_loss', '_image', '_thumbnail')
+
+    def __init__(self, image, contour, holes, area, mean_temp, heat_loss, bbox=None):
+        """
+        :param image: imagen de la que se recortará la miniatura (no se copia)
+        :param contour: contorno exterior de la zona en coordenadas de la imagen, o None si no se conoce (por
+            ejemplo en el modo por mosaicos); en ese caso la miniatura no dibuja bordes
+        :param holes: lista de contornos de los huecos de la zona
+        :param area: área en m²
+        :param mean_temp: temperatura promedio
+        :param heat_loss: pérdida de calor
+        :param bbox: tuple (x, y, ancho, alto); si no se indica se calcula a partir del contorno
+        """
+
+        self.contour = contour
+        self.holes = holes
+        self.bbox = tuple(int(v) for v in (bbox if bbox is not None else cv2.boundingRect(contour)))
+        self.area = float(area)
+        self.mean_temp = float(mean_temp)
+        self.heat_loss = float(heat_loss)
+        self._image = image
+        self._thumbnail = None
+
+    def __repr__(self):
+        return (f'HeatZone(bbox={self.bbox}, area={self.area:.6f}, mean_temp={self.mean_temp:.2f}, '
+                f'heat_loss={self.heat_loss:.8f})')
+
+    def thumbnail(self, max_size=THUMBNAIL_SIZE, padding=2, cache=True):
+        """
+        Devuelve el recorte de la zona con sus bordes dibujados, reducido para que su lado mayor no supere
+        `max_size` píxeles. Con `cache=False` se reutiliza la miniatura guardada si existe, pero una nueva no
+        se guarda. La miniatura guardada solo se reutiliza si se pidió con los mismos `max_size` y `padding`.
+        """
+
+        if self._thumbnail is not None and self._thumbnail[0] == (max_size, padding):
+            return self._thumbnail[1]
+
+        height, width = self._image.shape[:2]
+        x, y, w, h = self.bbox
+        x0, y0 = max(x - padding, 0), max(y - padding, 0)
+        x1, y1 = min(x + w + padding, width), min(y + h + padding, height)
+
+        thumbnail = self._image[y0:y1, x0:x1].copy()
+        if self.contour is not None:
+            cv2.drawContours(thumbnail, [self.contour] + list(self.holes), -1, (0, 0, 0), 2, offset=(-x0, -y0))
+
+        scale = max_size / max(thumbnail.shape[:2])
+        if scale < 1:
+            thumbnail = cv2.resize(thumbnail, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        if cache:
+            self._thumbnail = ((max_size, padding), thumbnail)
+
+        return thumbnail
+
+
+def contour_children(hierarchy):
+    """
+    Construye en una sola pasada el índice padre → hijos de la jerarquía de `cv2.findContours`.
+
+    :param hierarchy: jerarquía de `cv2.findContours` (None si no hay contornos)
+    :return: lista con los índices de los contornos hijos de cada contorno
+    """
+
+    if hierarchy is None:
+        return []
+
+    parents = hierarchy[0][:, 3].tolist()
+    children = [[] for _ in parents]
+    for index, parent in enumerate(parents):
+        if parent != -1:
+            children[parent].append(index)
+
+    return children
+
+
+def pack_zone_geometry(zones, px_per_meter=1):
+    """
+    Convierte la geometría y las medidas independientes de las constantes físicas de una lista de zonas en
+    arrays planos, para guardarlos (por ejemplo en `cache.ResultCache`) sin pickle.
+
+    :param px_per_meter: escala con la que se calcularon las áreas, para guardarlas en píxeles; con 1 las
+        áreas se guardan tal como están
+    :return: dict de np.ndarray
+    """
+
+    contours = [zone.contour.reshape(-1, 2) if zone.contour is not None else np.empty((0, 2), np.int32)
+                for zone in zones]
+    holes = [(index, hole.reshape(-1, 2)) for index, zone in enumerate(zones) for hole in zone.holes]
+
+    return {
+        'area_px': np.array([zone.area for zone in zones], dtype=np.float64) * px_per_meter ** 2,
+        'mean_temp': np.array([zone.mean_temp for zone in zones], dtype=np.float64),
+        'bbox': np.array([zone.bbox for zone in zones], dtype=np.int32).reshape(-1, 4),
+        'contour_points': np.concatenate(contours or [np.empty((0, 2), np.int32)]).astype(np.int32),
+        'contour_offsets': np.cumsum([0] + [len(c) for c in contours]),
+        'hole_zone': np.array([index for index, _ in holes], dtype=np.int64),
+        'hole_points': np.concatenate([h for _, h in holes] or [np.empty((0, 2), np.int32)]).astype(np.int32),
+        'hole_offsets': np.cumsum([0] + [len(h) for _, h in holes]),
+    }
+
+
+def unpack_zone_geometry(arrays):
+    """
+    Inversa de `pack_zone_geometry`.
+
+    :return: lista de tuple (contorno, huecos, bbox, área en píxeles, temperatura promedio)
+    """
+
+    offsets, points = arrays['contour_offsets'], arrays['contour_points']
+    contours = [points[start:end].reshape(-1, 1, 2) for start, end in zip(offsets[:-1], offsets[1:])]
+
+    holes = [[] for _ in contours]
+    offsets, points = arrays['hole_offsets'], arrays['hole_points']
+    for index, start, end in zip(arrays['hole_zone'], offsets[:-1], offsets[1:]):
+        holes[index].append(points[start:end].reshape(-1, 1, 2))
+
+    return list(zip(contours, holes, arrays['bbox'].tolist(), arrays['area_px'], arrays['mean_temp']))